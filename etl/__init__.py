@@ -1,17 +1,37 @@
 import abc
+import argparse
+import asyncio
+import contextvars
+import copy
+import hashlib
+import itertools
 import json
 import logging
 import os
+import select
+import sys
 import time
-from dataclasses import dataclass
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from functools import wraps
-from typing import Any, Dict, Generator, List, Tuple
+from typing import (Any, Callable, Dict, Generator, Iterable, List, Optional,
+                    Tuple)
 
 import backoff
 import coloredlogs
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from elasticsearch import Elasticsearch, helpers
+from dateutil.parser import parse as dateutil_parse
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
+                                            ConsoleSpanExporter)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 from pydantic import BaseSettings
 from redis import Redis
 from rediscluster import RedisCluster
@@ -20,6 +40,52 @@ logger = logging.getLogger("ETL")
 
 coloredlogs.install(level="DEBUG", logger=logger)
 
+# спаны батчей и стадий, пока setup_tracing не вызван, ничего не записывается
+tracer = trace.get_tracer("ETL")
+
+# пауза между шагами конвейера, чтобы не нагружать базу и elastic
+THROTTLE_SECONDS = float(os.getenv("ETL_THROTTLE_SECONDS", 0.5))
+
+# Метрики prometheus, скорость считается в prometheus через rate()
+ETL_ROWS = Counter(
+    'etl_rows_total',
+    'Строки и документы, прошедшие через стадию ETL',
+    ['process', 'stage']
+)
+STAGE_SECONDS = Histogram(
+    'etl_stage_seconds',
+    'Время выполнения стадии ETL на один батч',
+    ['process', 'stage']
+)
+PG_QUERY_SECONDS = Histogram(
+    'etl_postgres_query_seconds',
+    'Время выполнения запроса к postgres'
+)
+ES_BULK_SECONDS = Histogram(
+    'etl_elastic_bulk_seconds',
+    'Время выполнения bulk-запроса к elasticsearch',
+    ['index'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+)
+ES_BULK_ERRORS = Counter(
+    'etl_elastic_bulk_errors_total',
+    'Ошибки загрузки документов в elasticsearch',
+    ['index']
+)
+FRESHNESS_LAG = Gauge(
+    'etl_freshness_lag_seconds',
+    'Сколько секунд назад все изменения были загружены: возраст самого старого '
+    'незагруженного изменения или время с последней проверки, не нашедшей изменений. '
+    'Считается при сборе метрик, поэтому растёт, и когда ETL завис',
+    ['lookup']
+)
+
+# каталог с маппингами индексов, в контейнере лежит рядом с etl.py
+INDEX_MAPPINGS_DIR = os.getenv(
+    "INDEX_MAPPINGS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index_elastic')
+)
+
 
 class ETLConfig(BaseSettings):
     db_url: str = "postgresql://{user}:{password}@{host}:5432/{db}".format(
@@ -30,6 +96,82 @@ class ETLConfig(BaseSettings):
     )
     run_once: bool = os.getenv("RUN_ONCE")
     elasticsearch_hosts: str = os.getenv("ELASTICSEARCH_HOSTS")
+    checkpoint_every: int = os.getenv("CHECKPOINT_EVERY", 1)
+    # получать изменения через LISTEN/NOTIFY, опрос таблиц остаётся запасным
+    cdc_enabled: bool = os.getenv("CDC_ENABLED", False)
+    reindex_batch_size: int = os.getenv("REINDEX_BATCH_SIZE", 1000)
+    reindex_threads: int = os.getenv("REINDEX_THREADS", 4)
+    # перестраивать при старте индексы, маппинг которых изменился
+    reindex_on_drift: bool = os.getenv("REINDEX_ON_DRIFT", True)
+    # не отправлять в elastic документы, содержимое которых не изменилось
+    doc_hash_enabled: bool = os.getenv("DOC_HASH_ENABLED", True)
+    # больше 1 - преобразование больших батчей в пуле процессов
+    transform_workers: int = os.getenv("TRANSFORM_WORKERS", 1)
+    transform_chunk_size: int = os.getenv("TRANSFORM_CHUNK_SIZE", 250)
+    # extract, transform и load батчей идут параллельно (AsyncETLPipeline)
+    async_pipeline: bool = os.getenv("ASYNC_PIPELINE", False)
+    # вести рейтинги фильмов в redis (FilmLeaderboard) для списков в API
+    leaderboard_enabled: bool = os.getenv("LEADERBOARD_ENABLED", True)
+    # сообщать API id изменённых документов для локальных снимков (SnapshotChangeFeed)
+    snapshot_feed_enabled: bool = os.getenv("SNAPSHOT_FEED_ENABLED", True)
+    pipeline_queue_size: int = os.getenv("PIPELINE_QUEUE_SIZE", 2)
+    # порт с метриками prometheus, 0 - не запускать
+    metrics_port: int = os.getenv("ETL_METRICS_PORT", 8001)
+    # трассировка: otlp, file (спаны построчно в tracing_file) или none
+    tracing_exporter: str = os.getenv("TRACING_EXPORTER", "none")
+    tracing_otlp_endpoint: str = os.getenv(
+        "TRACING_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+    tracing_file: str = os.getenv("TRACING_FILE", "/tmp/etl-traces.jsonl")
+    # батчей немного, поэтому по умолчанию записываются все
+    tracing_sample_ratio: float = os.getenv("TRACING_SAMPLE_RATIO", 1.0)
+
+
+def setup_tracing(config: ETLConfig) -> Optional[TracerProvider]:
+    if config.tracing_exporter == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+            OTLPSpanExporter
+        exporter = OTLPSpanExporter(endpoint=config.tracing_otlp_endpoint)
+    elif config.tracing_exporter == 'file':
+        exporter = ConsoleSpanExporter(
+            out=open(config.tracing_file, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    else:
+        return None
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': 'etl'}),
+        sampler=ParentBased(TraceIdRatioBased(config.tracing_sample_ratio)))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+@contextmanager
+def measure_stage(process: str, stage: str):
+    """Время стадии в STAGE_SECONDS и спан стадии внутри спана батча"""
+    with tracer.start_as_current_span(f'etl {stage}', attributes={'etl.process': process}) as span, \
+            STAGE_SECONDS.labels(process, stage).time():
+        yield span
+
+
+def get_elastic(config: ETLConfig, **kwargs) -> Elasticsearch:
+    elastic_settings = dict(
+        hosts=config.elasticsearch_hosts,
+        sniff_on_start=True,
+        sniff_on_connection_fail=True,
+        sniffer_timeout=100
+    )
+    elastic_settings.update(kwargs)
+    return Elasticsearch(**elastic_settings)
+
+
+def get_async_elastic(config: ETLConfig, **kwargs) -> AsyncElasticsearch:
+    elastic_settings = dict(
+        hosts=config.elasticsearch_hosts,
+        sniff_on_connection_fail=True,
+        sniffer_timeout=100
+    )
+    elastic_settings.update(kwargs)
+    return AsyncElasticsearch(**elastic_settings)
 
 
 class BaseStorage:
@@ -60,6 +202,25 @@ class RedisStorage(BaseStorage):
         return json.loads(raw_data)
 
 
+class MemoryStorage(BaseStorage):
+    """
+    Состояние в памяти процесса для разовых проходов по изменениям
+    (догрузка при перестройке индекса, бенчмарки), чекпоинты живого
+    ETL не трогает.
+    До первого сохранения по любому пути отдаётся initial.
+    """
+
+    def __init__(self, initial: dict = None):
+        self.initial = initial or {}
+        self.data: Dict[str, dict] = {}
+
+    def save_state(self, state: dict, path: str = None) -> None:
+        self.data[path] = dict(state)
+
+    def retrieve_state(self, path: str = None) -> dict:
+        return dict(self.data.get(path, self.initial))
+
+
 class State:
     """
     Класс для хранения состояния при работе с данными, чтобы постоянно не перечитывать данные с начала.
@@ -67,9 +228,13 @@ class State:
     В целом ничего не мешает поменять это поведение на работу с БД или распределённым хранилищем.
     """
 
-    def __init__(self, storage: BaseStorage, path: str = None):
+    def __init__(self, storage: BaseStorage, path: str = None,
+                 flush_every: int = 1):
         self.storage = storage
         self.path = path
+        # сохранять состояние в хранилище раз в flush_every обновлений
+        self.flush_every = max(int(flush_every or 1), 1)
+        self._pending_updates = 0
         self.state = self.retrieve_state()
 
     def retrieve_state(self) -> dict:
@@ -80,15 +245,171 @@ class State:
 
     def set_key(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа"""
-        self.state[key] = value
-
+        self.set_keys({key: value})
+
+    def set_keys(self, values: Dict[str, Any]) -> None:
+        """
+        Установить состояние сразу для нескольких ключей.
+        Все ключи записываются в хранилище одной операцией,
+        поэтому чекпоинт не может сохраниться наполовину.
+        """
+        self.state.update(values)
+        self._pending_updates += 1
+        if self._pending_updates >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Записать накопленные изменения состояния в хранилище"""
+        if not self._pending_updates:
+            return
         self.storage.save_state(self.state, path=self.path)
+        self._pending_updates = 0
 
     def get_key(self, key: str) -> Any:
         """Получить состояние по определённому ключу"""
         return self.state.get(key)
 
 
+@dataclass
+class DocumentHashStore:
+    """
+    Хэши последних загруженных в elastic документов, по hash-ключу
+    redis на индекс. Позволяет не отправлять документы, содержимое
+    которых не изменилось с прошлой загрузки.
+    """
+    redis_adapter: Any
+    prefix: str = 'etl_doc_hashes'
+
+    def _key(self, index: str) -> str:
+        return f'{self.prefix}:{index}'
+
+    @staticmethod
+    def hash_doc(doc: dict) -> str:
+        raw = json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def filter_changed(self, index: str,
+                       docs: List[dict]) -> Tuple[List[dict], Dict[str, str]]:
+        """Вернуть изменившиеся документы и их новые хэши"""
+        hashes = {str(doc['id']): self.hash_doc(doc) for doc in docs}
+        ids = list(hashes)
+        stored = dict(zip(ids, self.redis_adapter.hmget(self._key(index), ids)))
+        changed_hashes = {
+            doc_id: doc_hash for doc_id, doc_hash in hashes.items()
+            if stored[doc_id] is None or stored[doc_id].decode() != doc_hash
+        }
+        changed = [doc for doc in docs if str(doc['id']) in changed_hashes]
+        return changed, changed_hashes
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def save(self, index: str, hashes: Dict[str, str]) -> None:
+        self.redis_adapter.hset(self._key(index), mapping=hashes)
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def reset(self, index: str) -> None:
+        self.redis_adapter.delete(self._key(index))
+
+
+@dataclass
+class FilmLeaderboard:
+    """
+    Фильмы по рейтингу для API: общий sorted set и по одному на жанр,
+    score - imdb_rating. В sorted set'ах только id: по ним API берёт
+    страницу в нужном порядке, а сами документы читает из elastic по id.
+    Фильмы без рейтинга получают score -inf и, как в сортировке elastic,
+    идут последними при любом порядке (для ASC это учитывает API).
+    Ключи версионные: полная перестройка пишет новое поколение
+    и одним SET переключает на него {films}:current, до первого
+    построения API читает из elastic.
+    Hash tag {films} держит все ключи в одном слоте кластера.
+    """
+    redis_adapter: Any
+    prefix: str = '{films}'
+    # версия формата ключей в имени поколения: поколение старого
+    # формата ETL при старте перестраивает, а до того не обновляет
+    version: str = 'v2'
+
+    def _key(self, generation: str, name: str) -> str:
+        return f'{self.prefix}:{generation}:{name}'
+
+    def current(self) -> Optional[str]:
+        generation = self.redis_adapter.get(f'{self.prefix}:current')
+        return generation.decode() if generation else None
+
+    def is_built(self) -> bool:
+        """Построено ли текущее поколение в текущем формате"""
+        generation = self.current()
+        return generation is not None and generation.startswith(f'{self.version}-')
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def update(self, docs: List[dict]) -> None:
+        """Обновить рейтинги загруженных в elastic фильмов"""
+        if not self.is_built():
+            # ещё не построено, эти фильмы попадут туда при построении
+            return
+        self._write(self.current(), docs)
+
+    def rebuild(self, batches: Iterable[List[dict]]) -> int:
+        """Построить новое поколение из всех фильмов и переключиться на него"""
+        old_generation = self.current()
+        generation = f"{self.version}-{time.strftime('%Y%m%d%H%M%S')}"
+        count = 0
+        for docs in batches:
+            self._write(generation, docs)
+            count += len(docs)
+        self.redis_adapter.set(f'{self.prefix}:current', generation)
+        if old_generation and old_generation != generation:
+            for key in self.redis_adapter.scan_iter(
+                    match=self._key(old_generation, '*')):
+                self.redis_adapter.delete(key)
+        return count
+
+    def _write(self, generation: str, docs: List[dict]) -> None:
+        genres_key = self._key(generation, 'genres')
+        # жанры, по которым уже есть рейтинги: из них убираем фильмы,
+        # которые больше не относятся к жанру
+        known_genres = {genre_id.decode() for genre_id in self.redis_adapter.smembers(genres_key)}
+        pipe = self.redis_adapter.pipeline()
+        for doc in docs:
+            film_id = str(doc['id'])
+            rating = doc.get('imdb_rating')
+            score = float('-inf') if rating is None else rating
+            genres = {str(genre['id']) for genre in doc.get('genres') or ()}
+            for genre_id in known_genres - genres:
+                pipe.zrem(self._key(generation, f'genre:{genre_id}'), film_id)
+            pipe.zadd(self._key(generation, 'rating'), {film_id: score})
+            for genre_id in genres:
+                pipe.zadd(self._key(generation, f'genre:{genre_id}'), {film_id: score})
+            known_genres |= genres
+        if known_genres:
+            pipe.sadd(genres_key, *known_genres)
+        pipe.execute()
+
+
+@dataclass
+class SnapshotChangeFeed:
+    """
+    Id изменённых документов для снимков горячих объектов в API
+    (services/snapshot.py): sorted set на индекс, score - время изменения.
+    API перечитывает из elastic только те id, что есть в его снимке.
+    Записи старше retention секунд удаляются при публикации.
+    """
+    redis_adapter: Any
+    retention: int = 24 * 60 * 60
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def publish(self, index: str, ids: List[str]) -> None:
+        if not ids:
+            return
+        key = f'snapshot:changes:{index}'
+        now = time.time()
+        pipe = self.redis_adapter.pipeline()
+        pipe.zadd(key, {str(doc_id): now for doc_id in ids})
+        pipe.zremrangebyscore(key, '-inf', now - self.retention)
+        pipe.execute()
+
+
 def coroutine(func):
     @wraps(func)
     def inner(*args, **kwargs):
@@ -110,23 +431,218 @@ class PostgresDatabase:
             with connection.cursor(
                     cursor_factory=psycopg2.extras.RealDictCursor
             ) as cursor:
-                cursor.execute(template, params)
-                results = [dict(r) for r in cursor.fetchall()]
+                with PG_QUERY_SECONDS.time():
+                    cursor.execute(template, params)
+                    results = [dict(r) for r in cursor.fetchall()]
         return results
 
 
+CDC_CHANNEL = 'content_changes'
+CDC_TABLES = (
+    'content.film_work',
+    'content.genre',
+    'content.person',
+    'content.person_film_role',
+)
+CDC_FUNCTION_SQL = '''
+CREATE OR REPLACE FUNCTION content.notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        TG_ARGV[0],
+        json_build_object(
+            'table', TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME,
+            'id', NEW.id
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+CDC_TRIGGER_SQL = '''
+DROP TRIGGER IF EXISTS notify_change ON {table};
+CREATE TRIGGER notify_change
+    AFTER INSERT OR UPDATE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE content.notify_change('{channel}');
+'''
+
+
+@dataclass
+class ChangeSubscription:
+    """Очередь id изменённых строк одной таблицы для одного lookup'а"""
+    # dict вместо set, чтобы сохранить порядок уведомлений
+    ids: Dict[str, None] = field(default_factory=dict)
+    # пока True, lookup догоняет пропущенные изменения опросом таблицы
+    needs_poll: bool = True
+
+    def take(self, limit: int) -> List[str]:
+        taken = list(itertools.islice(self.ids, limit))
+        for row_id in taken:
+            del self.ids[row_id]
+        return taken
+
+
+@dataclass
+class ChangeListener:
+    """
+    Получает уведомления об изменениях через LISTEN/NOTIFY postgres
+    и раскладывает id строк по подпискам lookup'ов.
+    Пока соединение не установлено или было потеряно, подписки
+    переводятся в режим опроса таблиц по полю modified.
+    """
+    url: str
+    channel: str = CDC_CHANNEL
+    connection: Any = field(default=None, init=False, repr=False)
+    subscriptions: Dict[str, List[ChangeSubscription]] = field(
+        default_factory=dict, init=False, repr=False)
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def install_triggers(self) -> None:
+        """Создать триггеры, отправляющие уведомления при изменении таблиц"""
+        with psycopg2.connect(self.url) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(CDC_FUNCTION_SQL)
+                for table in CDC_TABLES:
+                    cursor.execute(CDC_TRIGGER_SQL.format(
+                        table=table, channel=self.channel))
+        logger.info(f'CDC triggers installed on {", ".join(CDC_TABLES)}')
+
+    @property
+    def connected(self) -> bool:
+        return self.connection is not None
+
+    def subscribe(self, table: str) -> ChangeSubscription:
+        subscription = ChangeSubscription()
+        self.subscriptions.setdefault(table, []).append(subscription)
+        return subscription
+
+    def _connect(self) -> None:
+        connection = psycopg2.connect(self.url)
+        connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel};')
+        self.connection = connection
+        logger.info(f'Listening to {self.channel} notifications')
+
+    def _disconnect(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+        self.connection = None
+        # уведомления, отправленные без нас, потеряны - догоняем опросом
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.needs_poll = True
+
+    def poll(self) -> int:
+        """Забрать накопившиеся уведомления, вернуть их количество"""
+        try:
+            if self.connection is None:
+                self._connect()
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logger.error(f'Lost {self.channel} listener connection: {e}')
+            self._disconnect()
+            return 0
+
+        received = 0
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+                table, row_id = payload['table'], payload['id']
+            except (ValueError, KeyError):
+                logger.warning(f'Malformed notification: {notify.payload}')
+                continue
+            for subscription in self.subscriptions.get(table, ()):
+                subscription.ids[row_id] = None
+            received += 1
+        return received
+
+    def wait(self, timeout: float) -> None:
+        """Ждать уведомлений не дольше timeout секунд"""
+        if self.poll():
+            return
+        if self.connection is None:
+            time.sleep(timeout)
+            return
+        select.select([self.connection], [], [], timeout)
+        self.poll()
+
+
 @dataclass
 class Lookup:
     db: PostgresDatabase
     storage: Any
     path_redis: str = None
+    # если True, чекпоинт не пишется сразу после target.send,
+    # а откладывается до вызова commit_pending (см. FilmChangeSetLookup)
+    defer_checkpoint: bool = False
+    pending_checkpoint: Dict[str, Any] = field(default=None, repr=False)
+    # писать чекпоинт в redis раз в checkpoint_every батчей
+    checkpoint_every: int = 1
+    _state: State = field(default=None, init=False, repr=False)
+    # источник уведомлений об изменениях (CDC), None - только опрос таблиц
+    listener: 'ChangeListener' = None
+    _changes: Dict[str, 'ChangeSubscription'] = field(
+        default_factory=dict, init=False, repr=False)
+    _cursor: Dict[str, Any] = field(default=None, init=False, repr=False)
+    # время (unix), до которого все изменения таблицы загружены
+    watermark: float = field(default=None, init=False, repr=False)
 
     @property
-    def state(self):
-        return State(
-            self.storage,
-            path=self.path_redis or self.__class__.__name__ + '_state'
-        )
+    def name(self) -> str:
+        return self.path_redis or self.__class__.__name__ + '_state'
+
+    def freshness_lag(self) -> float:
+        """Отставание ETL по этому lookup'у в секундах, 0 - ещё не опрашивали"""
+        if self.watermark is None:
+            return 0
+        return max(time.time() - self.watermark, 0)
+
+    @property
+    def state(self) -> State:
+        # состояние читается из хранилища один раз и дальше живёт в памяти
+        if self._state is None:
+            self._state = State(
+                self.storage,
+                path=self.name,
+                flush_every=self.checkpoint_every
+            )
+        return self._state
+
+    def commit_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """Сохранить позицию, до которой обработаны изменения"""
+        self.state.set_keys({
+            'last_updated_at': checkpoint['last_updated_at'],
+            'last_id': checkpoint['last_id']
+        })
+
+    def flush_state(self) -> None:
+        """Записать в хранилище чекпоинт, ещё не сохранённый из-за checkpoint_every"""
+        if self._state is not None:
+            self._state.flush()
+
+    def commit_pending(self) -> None:
+        """Сохранить отложенный чекпоинт, если он есть"""
+        self.commit_taken(self.take_pending())
+
+    def take_pending(self) -> Dict[str, Any]:
+        """Забрать отложенный чекпоинт, чтобы сохранить его позже"""
+        checkpoint, self.pending_checkpoint = self.pending_checkpoint, None
+        return checkpoint
+
+    def commit_taken(self, checkpoint: Dict[str, Any]) -> None:
+        if checkpoint:
+            self.commit_checkpoint(checkpoint)
+
+    def query(self, template: str, params: Dict[str, Any]) -> List[dict]:
+        with measure_stage(self.name, 'lookup') as span:
+            rows = self.db.query(template, params)
+            span.set_attribute('etl.rows', len(rows))
+            return rows
 
     def get_updated_rows(self, table, modified, column_return=None):
 
@@ -136,40 +652,58 @@ class Lookup:
             last_updated_at = "0001-01-01 00:00:00.992496+00"
             while True and batch_num == 0:
 
-                state = self.state
-                last_updated_at = state.get_key(
+                # при отложенных чекпоинтах читаем дальше с позиции
+                # последнего отданного батча, а не с сохранённой
+                cursor = self._cursor or self.state.state
+                last_updated_at = cursor.get(
                     'last_updated_at') or last_updated_at
-                last_id = state.get_key('last_id')
+                last_id = cursor.get('last_id')
 
                 if column_return:
                     select_columns = ",".join(["id", modified, column_return])
                 else:
                     select_columns = ",".join(["id", modified])
 
-                modified_rows: List[Dict] = self.db.query(
-                    f'''
-                    SELECT {select_columns} from {table}
-                    '''
-                    +
-                    f'''
-                    WHERE  {modified} = %(last_updated_at)s and id > %(last_id)s::uuid
-                    or {modified} > %(last_updated_at)s
-                    ''' * bool(last_updated_at)
-                    + f'''
-                    ORDER BY {modified}, id
-                    LIMIT %(batch_size)s;
-                    ''', {
-                        'last_updated_at': last_updated_at,
-                        'batch_size': batch_size,
-                        'last_id': last_id
-                    }
-                )
-                time.sleep(0.5)
+                changes = self._get_changes(table)
+                if changes is not None and not changes.needs_poll:
+                    # режим CDC: берём id, о которых сообщил postgres,
+                    # вместо опроса всей таблицы по полю modified
+                    changed_ids = changes.take(batch_size)
+                    if not changed_ids:
+                        logger.debug(f'No notified changes in {table}')
+                        self.watermark = time.time()
+                        break
+                    modified_rows: List[Dict] = self.query(
+                        f'''
+                        SELECT {select_columns} from {table}
+                        WHERE id = ANY(%(changed_ids)s::uuid[])
+                        ORDER BY {modified}, id;
+                        ''', {
+                            'changed_ids': changed_ids
+                        }
+                    )
+                    if not modified_rows:
+                        break
+                else:
+                    modified_rows = self._poll_updated_rows(
+                        table, modified, select_columns,
+                        last_updated_at, last_id, batch_size
+                    )
+                time.sleep(THROTTLE_SECONDS)
                 if not modified_rows:
                     logger.info(
                         f'No updated rows in {table} since {last_updated_at}')
+                    self.watermark = time.time()
+                    if (changes is not None and changes.needs_poll
+                            and self.listener.connected):
+                        # опрос догнал таблицу, дальше хватит уведомлений
+                        changes.needs_poll = False
+                        logger.info(f'Switched {table} lookup to notifications')
                     break
                 first, last = modified_rows[0], modified_rows[-1]
+                # всё, что изменено раньше первой найденной строки, уже загружено
+                self.watermark = dateutil_parse(str(first[modified])).timestamp()
+                ETL_ROWS.labels(self.name, 'lookup').inc(len(modified_rows))
                 logger.info(
                     '\n'
                     f'    Found {len(modified_rows)} updated rows in {table} - Batch #{batch_num}:\n'
@@ -184,12 +718,61 @@ class Lookup:
                     results_: List[str] = [row["id"] for row in modified_rows]
 
                 target.send(results_)
-                state.set_key('last_updated_at', str(last[modified]))
-                state.set_key('last_id', last['id'])
+                checkpoint = {
+                    'last_updated_at': str(last[modified]),
+                    'last_id': last['id']
+                }
+                if not self._is_after(checkpoint, last_updated_at, last_id):
+                    # уведомление пришло о строке, которая уже
+                    # покрыта чекпоинтом, двигать его назад нельзя
+                    batch_num += 1
+                    continue
+                self._cursor = checkpoint
+                if self.defer_checkpoint:
+                    self.pending_checkpoint = checkpoint
+                else:
+                    self.commit_checkpoint(checkpoint)
                 batch_num += 1
 
         return inner
 
+    def _poll_updated_rows(self, table, modified, select_columns,
+                           last_updated_at, last_id, batch_size) -> List[Dict]:
+        return self.query(
+            f'''
+            SELECT {select_columns} from {table}
+            '''
+            +
+            f'''
+            WHERE  {modified} = %(last_updated_at)s and id > %(last_id)s::uuid
+            or {modified} > %(last_updated_at)s
+            ''' * bool(last_updated_at)
+            + f'''
+            ORDER BY {modified}, id
+            LIMIT %(batch_size)s;
+            ''', {
+                'last_updated_at': last_updated_at,
+                'batch_size': batch_size,
+                'last_id': last_id
+            }
+        )
+
+    def _get_changes(self, table: str):
+        if self.listener is None:
+            return None
+        if table not in self._changes:
+            self._changes[table] = self.listener.subscribe(table)
+        return self._changes[table]
+
+    @staticmethod
+    def _is_after(checkpoint: Dict[str, Any], last_updated_at: str,
+                  last_id: str) -> bool:
+        new_at = dateutil_parse(checkpoint['last_updated_at'])
+        old_at = dateutil_parse(last_updated_at)
+        if new_at != old_at:
+            return new_at > old_at
+        return last_id is None or str(checkpoint['last_id']) > str(last_id)
+
 
 @dataclass
 class PersonLookupPersonETL(Lookup):
@@ -201,37 +784,6 @@ class PersonLookupPersonETL(Lookup):
         )
 
 
-@dataclass
-class PersonLookup(Lookup):
-    def produce(self, target: Generator):
-        get_updated_persons = self.get_updated_rows(
-            'content.person', 'modified')
-        get_updated_persons(
-            self._get_person_films(
-                target=target
-            )
-        )
-
-    @coroutine
-    def _get_person_films(self, target: Generator):
-        updated_persons: List[dict]
-        while person_ids := (yield):
-            person_films: List[dict] = self.db.query(
-                '''
-                SELECT pfr.film_id as id
-                FROM content.person_film_role pfr
-                where pfr.person_id = ANY(%(person_ids)s::uuid[])
-                ''',
-                {
-                    'person_ids': person_ids
-                }
-            )
-            film_ids: List[str] = [film['id'] for film in person_films]
-            time.sleep(0.5)
-            if film_ids:
-                target.send(film_ids)
-
-
 @dataclass
 class PersonFilmRoleLookup(Lookup):
     def produce(self, target: Generator):
@@ -257,7 +809,7 @@ class GenreLookup(Lookup):
     def _get_updated_genre_films(self, target: Generator):
         updated_persons: List[dict]
         while genre_ids := (yield):
-            genre_films: List[dict] = self.db.query(
+            genre_films: List[dict] = self.query(
                 '''
                 SELECT fwr.filmwork_id as id
                 FROM content.film_work_genre fwr
@@ -268,8 +820,54 @@ class GenreLookup(Lookup):
                 }
             )
             film_ids: List[str] = [film['id'] for film in genre_films]
-            time.sleep(0.5)
-            target.send(film_ids)
+            time.sleep(THROTTLE_SECONDS)
+            if film_ids:
+                target.send(film_ids)
+
+
+@dataclass
+class PersonFilmLookup(Lookup):
+    """
+    Фильмы персон с изменёнными данными. В живом ETL имена персон
+    переносит ETLProcessPersonRename, этот lookup нужен для догрузки
+    индекса movies при перестройке.
+    """
+
+    def produce(self, target: Generator):
+        get_updated_persons = self.get_updated_rows(
+            'content.person', 'modified')
+        get_updated_persons(
+            self._get_person_films(
+                target
+            )
+        )
+
+    @coroutine
+    def _get_person_films(self, target: Generator):
+        while person_ids := (yield):
+            person_films: List[dict] = self.query(
+                '''
+                SELECT DISTINCT pfr.film_id as id
+                FROM content.person_film_role pfr
+                WHERE pfr.person_id = ANY(%(person_ids)s::uuid[])
+                ''',
+                {
+                    'person_ids': person_ids
+                }
+            )
+            film_ids: List[str] = [film['id'] for film in person_films]
+            if film_ids:
+                target.send(film_ids)
+
+
+@dataclass
+class GenreLookupGenreETL(Lookup):
+    def produce(self, target: Generator):
+        get_updated_genres = self.get_updated_rows(
+            'content.genre', 'modified')
+        get_updated_genres(
+            target=target
+        )
 
 
 @dataclass
@@ -282,57 +880,288 @@ class FilmWorkLookup(Lookup):
         )
 
 
+@dataclass
+class FilmChangeSetLookup:
+    """
+    Объединяет изменения из нескольких lookup'ов индекса movies.
+    За один цикл собирает id фильмов от всех lookup'ов, убирает дубли
+    и отправляет их дальше одним батчем, поэтому каждый фильм
+    извлекается и загружается в elastic один раз.
+    Чекпоинты lookup'ов сохраняются только после того,
+    как объединённый батч обработан.
+    """
+    lookups: List[Lookup]
+    # если True, чекпоинты сохраняет вызывающий через take_pending/commit_taken
+    defer_checkpoint: bool = False
+
+    def __post_init__(self):
+        for lookup in self.lookups:
+            lookup.defer_checkpoint = True
+
+    def flush_state(self) -> None:
+        for lookup in self.lookups:
+            lookup.flush_state()
+
+    def take_pending(self) -> List[Dict[str, Any]]:
+        checkpoints = [lookup.take_pending() for lookup in self.lookups]
+        return checkpoints if any(checkpoints) else None
+
+    def commit_taken(self, checkpoints: List[Dict[str, Any]]) -> None:
+        for lookup, checkpoint in zip(self.lookups, checkpoints or ()):
+            lookup.commit_taken(checkpoint)
+
+    def produce(self, target: Generator):
+        film_ids: Dict[str, None] = {}
+        for lookup in self.lookups:
+            lookup.produce(self._collect_film_ids(film_ids))
+
+        if film_ids:
+            logger.info(
+                f'Change set: {len(film_ids)} unique film works '
+                f'from {len(self.lookups)} lookups')
+            target.send(list(film_ids))
+
+        if not self.defer_checkpoint:
+            for lookup in self.lookups:
+                lookup.commit_pending()
+
+    @coroutine
+    def _collect_film_ids(self, film_ids: Dict[str, None]):
+        # dict вместо set, чтобы сохранить порядок поступления id
+        while True:
+            ids = yield
+            for film_id in ids or ():
+                film_ids[film_id] = None
+
+
 @dataclass
 class ETLProcess:
     db: PostgresDatabase
     config: ETLConfig
     lookup: Lookup
     index: str
+    throttle: float = THROTTLE_SECONDS
+    # если задано, неизменившиеся документы не отправляются в elastic
+    hash_store: 'DocumentHashStore' = None
+    # пул процессов для преобразования больших батчей
+    transform_pool: Executor = None
+    transform_chunk_size: int = 250
+    # если задано, загруженные фильмы попадают и в рейтинги в redis
+    leaderboard: 'FilmLeaderboard' = None
+    # если задано, id загруженных документов получают снимки в API
+    change_feed: 'SnapshotChangeFeed' = None
 
     @abc.abstractmethod
     def extract(self):
         pass
 
+    def query(self, template: str, params: Dict[str, Any]) -> List[dict]:
+        with measure_stage(self.name, 'extract') as span:
+            rows = self.db.query(template, params)
+            span.set_attribute('etl.rows', len(rows))
+            return rows
+
     @backoff.on_exception(backoff.expo, Exception, )
     def _bulk_update_elastic(self, docs: List[dict]) -> Tuple[int, list]:
-        elastic_settings = dict(
-            hosts=self.config.elasticsearch_hosts,
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniffer_timeout=100
-        )
-
-        def generate_doc(docs):
-            for doc in docs:
-                yield {
-                    '_index': self.index,
-                    '_id': doc['id'],
-                    '_source': doc
-                }
-
-        with Elasticsearch(**elastic_settings) as es:
+        with get_elastic(self.config) as es, self._measure_bulk(len(docs)):
             return helpers.bulk(
                 es,
-                generate_doc(docs)
+                self.generate_actions(docs)
+            )
+
+    @contextmanager
+    def _measure_bulk(self, size: int):
+        started = time.perf_counter()
+        try:
+            with tracer.start_as_current_span('etl load', attributes={
+                    'etl.process': self.name, 'etl.index': self.index, 'etl.rows': size}):
+                yield
+        except helpers.BulkIndexError as e:
+            ES_BULK_ERRORS.labels(self.index).inc(len(e.errors))
+            raise
+        except Exception:
+            ES_BULK_ERRORS.labels(self.index).inc()
+            raise
+        finally:
+            ES_BULK_SECONDS.labels(self.index).observe(
+                time.perf_counter() - started)
+
+    @property
+    def name(self) -> str:
+        return f'{self.__class__.__name__}:{self.index}'
+
+    def generate_actions(self, docs: List[dict]) -> Generator:
+        for doc in docs:
+            yield {
+                '_index': self.index,
+                '_id': doc['id'],
+                '_source': doc
+            }
+
+    def run_transform(self, transform: Callable, rows: List[dict]) -> List[dict]:
+        ETL_ROWS.labels(self.name, 'extract').inc(len(rows))
+        with measure_stage(self.name, 'transform'):
+            if self.transform_pool is None or len(rows) <= self.transform_chunk_size:
+                docs = transform(rows)
+            else:
+                docs = transform_in_pool(
+                    self.transform_pool, transform, rows, self.transform_chunk_size)
+        ETL_ROWS.labels(self.name, 'transform').inc(len(docs))
+        return docs
+
+    def transform_batch(self, ids: List[str]) -> Any:
+        """
+        Прогнать id через extract и transform, вернуть то, что transform
+        отправляет в load: у большинства процессов это документы для elastic
+        """
+        payloads: List[Any] = []
+        self.extract(
+            self.transform_for_elastic(
+                self._collect_payloads(payloads)
             )
+        ).send(ids)
+        return self.merge_payloads(payloads)
+
+    @coroutine
+    def _collect_payloads(self, payloads: List[Any]):
+        while True:
+            payload = yield
+            if payload:
+                payloads.append(payload)
+
+    @staticmethod
+    def merge_payloads(payloads: List[Any]) -> Any:
+        """Объединить всё, что transform отправил в load за один батч"""
+        return list(itertools.chain.from_iterable(payloads))
+
+    async def _bulk_update_elastic_async(self, es: AsyncElasticsearch,
+                                         docs: List[dict]) -> Tuple[int, list]:
+        with self._measure_bulk(len(docs)):
+            return await helpers.async_bulk(es, self.generate_actions(docs))
+
+    def filter_unchanged(self, docs: List[dict]) -> Tuple[List[dict], Dict[str, str]]:
+        """Отбросить документы, которые не изменились с прошлой загрузки"""
+        if self.hash_store is None:
+            return docs, {}
+        return self.hash_store.filter_changed(self.index, docs)
+
+    def save_hashes(self, hashes: Dict[str, str]) -> None:
+        # хэши сохраняем только после успешной загрузки
+        if hashes:
+            self.hash_store.save(self.index, hashes)
+
+    def publish_changes(self, docs: Any) -> None:
+        """Сообщить о загруженных документах рейтингам фильмов и снимкам в API"""
+        if not docs:
+            return
+        if self.leaderboard is not None:
+            self.leaderboard.update(docs)
+        if self.change_feed is not None:
+            self.change_feed.publish(self.index, [doc['id'] for doc in docs])
+
+    def log_loaded(self, docs_updated: int, skipped: int) -> None:
+        ETL_ROWS.labels(self.name, 'load').inc(docs_updated)
+        ETL_ROWS.labels(self.name, 'skip').inc(skipped)
+        logger.info(
+            f"Updated {docs_updated} documents in '{self.index}' index"
+            + f", skipped {skipped} unchanged" * bool(skipped))
 
     @coroutine
     def load_to_elastic(self):
         docs: List[dict]
         while docs := (yield):
-            docs_updated, _ = self._bulk_update_elastic(docs)
-            logger.info(
-                f"Updated {docs_updated} documents in '{self.index}' index")
-            time.sleep(0.5)
+            total = len(docs)
+            docs, hashes = self.filter_unchanged(docs)
+            docs_updated = 0
+            if docs:
+                docs_updated, _ = self._bulk_update_elastic(docs)
+                self.publish_changes(docs)
+            self.save_hashes(hashes)
+            self.log_loaded(docs_updated, total - len(docs))
+            time.sleep(self.throttle)
 
     def run(self):
-        self.lookup.produce(
-            self.extract(
-                self.transform_for_elastic(
-                    self.load_to_elastic()
+        # один проход - один батч: все стадии выполняются внутри target.send
+        with tracer.start_as_current_span('etl batch', attributes={
+                'etl.process': self.name, 'etl.index': self.index}):
+            self.lookup.produce(
+                self.extract(
+                    self.transform_for_elastic(
+                        self.load_to_elastic()
+                    )
                 )
             )
-        )
+
+
+# Функции преобразования вынесены на уровень модуля,
+# чтобы их можно было выполнять в пуле процессов
+
+def transform_persons(persons: List[dict]) -> List[dict]:
+    persons_docs = []
+    for person in persons:
+        person_doc = {
+            'id': person['id'],
+            'full_name': person['full_name'],
+            'film_ids': set(),
+            'role': set()
+        }
+        if person.get('roles'):
+            for role in person['roles']:
+                person_doc['film_ids'].add(role['id'])
+                person_doc['role'].add(role['role'])
+
+        # сортируем, чтобы документ и его хэш не зависели от порядка в set
+        person_doc['film_ids'] = sorted(person_doc['film_ids'])
+        person_doc['role'] = sorted(person_doc['role'])
+        persons_docs.append(person_doc)
+    return persons_docs
+
+
+FILM_PERSON_FIELDS = {
+    'actor': ('actors', 'actors_names'),
+    'writer': ('writers', 'writers_names'),
+    'director': ('directors', 'directors_names'),
+}
+
+
+def transform_film_works(film_works: List[dict]) -> List[dict]:
+    film_work_docs = []
+    for film in film_works:
+        genres = film['genres'] or ()
+        film_work_doc = {
+            'id': film['id'],
+            'title': film['title'],
+            'description': film['description'],
+            'imdb_rating': film['rating'],
+            'genres_names': [g['name'] for g in genres],
+            'genres': [{'id': g['id'], 'name': g['name']} for g in genres],
+            'actors': [],
+            'writers': [],
+            'directors': [],
+            'actors_names': [],
+            'writers_names': [],
+            'directors_names': []
+        }
+        for person in film['persons'] or ():
+            fields = FILM_PERSON_FIELDS.get(person['role'])
+            if fields is None:
+                continue
+            persons_field, names_field = fields
+            film_work_doc[persons_field].append(
+                {'id': person['id'], 'name': person['full_name']})
+            film_work_doc[names_field].append(person['full_name'])
+        film_work_docs.append(film_work_doc)
+    return film_work_docs
+
+
+def transform_in_pool(pool: Executor, transform: Callable,
+                      rows: List[dict], chunk_size: int) -> List[dict]:
+    """
+    Разбить батч на части и преобразовать их в пуле процессов.
+    Порядок документов сохраняется, поэтому чекпоинты не ломаются.
+    """
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    return [doc for docs in pool.map(transform, chunks) for doc in docs]
 
 
 @dataclass
@@ -342,7 +1171,7 @@ class ETLProcessPerson(ETLProcess):
     def extract(self, target: Generator):
         film_ids: List[str]
         while person_ids := (yield):
-            persons: List[dict] = self.db.query(
+            persons: List[dict] = self.query(
                 '''
                 SELECT
                     person.id,
@@ -363,30 +1192,15 @@ class ETLProcessPerson(ETLProcess):
                 }
             )
             logger.info(f'Extracted {len(persons)} persons from database')
-            time.sleep(0.5)
-            target.send(persons)
+            time.sleep(self.throttle)
+            if persons:
+                target.send(persons)
 
     @coroutine
     def transform_for_elastic(self, target: Generator):
         persons: List[dict]
         while persons := (yield):
-            persons_docs = []
-            for person in persons:
-                person_doc = {
-                    'id': person['id'],
-                    'full_name': person['full_name'],
-                    'film_ids': set(),
-                    'role': set()
-                }
-                if person.get('roles'):
-                    for role in person['roles']:
-                        person_doc['film_ids'].add(role['id'])
-                        person_doc['role'].add(role['role'])
-
-                person_doc['film_ids'] = list(person_doc['film_ids'])
-                person_doc['role'] = list(person_doc['role'])
-                persons_docs.append(person_doc)
-            target.send(persons_docs)
+            target.send(self.run_transform(transform_persons, persons))
 
 
 @dataclass
@@ -396,7 +1210,7 @@ class ETLProcessFilmWork(ETLProcess):
     def extract(self, target: Generator):
         film_ids: List[str]
         while film_ids := (yield):
-            films: List[dict] = self.db.query(
+            films: List[dict] = self.query(
                 '''
                 SELECT
                     fw.id AS id,
@@ -415,7 +1229,7 @@ class ETLProcessFilmWork(ETLProcess):
                             'id', p.id,
                             'full_name', p.full_name,
                             'role', pfw.role
-                        )) AS persons
+                        ) ORDER BY p.full_name, p.id) AS persons
                     FROM "content".person_film_role pfw
                     JOIN "content".person p ON p.id = pfw.person_id
                     WHERE pfw.film_id = fw.id
@@ -426,9 +1240,8 @@ class ETLProcessFilmWork(ETLProcess):
                         gfw.filmwork_id,
                         array_agg(jsonb_build_object(
                             'id', g.id,
-                            'name', g.name,
-                            'description', g.description
-                        )) AS genres
+                            'name', g.name
+                        ) ORDER BY g.name, g.id) AS genres
                     FROM "content".film_work_genre gfw
                     JOIN "content".genre g ON g.id = gfw.genre_id
                     WHERE gfw.filmwork_id = fw.id
@@ -441,109 +1254,645 @@ class ETLProcessFilmWork(ETLProcess):
                 }
             )
             logger.info(f'Extracted {len(films)} film works from database')
-            time.sleep(0.5)
-            target.send(films)
+            time.sleep(self.throttle)
+            if films:
+                target.send(films)
 
     @coroutine
     def transform_for_elastic(self, target: Generator):
         film_works: List[dict]
         while film_works := (yield):
-            film_work_docs = []
-            genre_docs_raw = dict()
-            persons_docs_raw = dict()
-            for film in film_works:
-
-                for genre in film['genres']:
-                    genre_docs_raw[genre['id']] = {
-                        'id': genre['id'],
-                        'name': genre['name'],
-                        'description': genre['description']
-                    }
-
-                film_work_doc = {
-                    k: v for k, v in film.items()
-                    if k in ('id', 'title', 'description', 'type')
+            target.send(self.run_transform(transform_film_works, film_works))
+
+
+@dataclass
+class ETLProcessGenre(ETLProcess):
+
+    @coroutine
+    def extract(self, target: Generator):
+        genre_ids: List[str]
+        while genre_ids := (yield):
+            genres: List[dict] = self.query(
+                '''
+                SELECT
+                    genre.id,
+                    genre.name,
+                    genre.description
+                FROM content.genre genre
+                WHERE genre.id = ANY(%(genre_ids)s::uuid[]);
+                ''',
+                {
+                    'genre_ids': genre_ids
                 }
-                film_work_doc['genres_names'] = [g['name']
-                                                 for g in film['genres']]
-                film_work_doc['genres'] = [
-                    {'id': g['id'], 'name': g['name']} for g in film['genres']]
-
-                film_work_doc['imdb_rating'] = film['rating']
-                film_work_doc.update({
-                    'actors': [],
-                    'writers': [],
-                    'directors': [],
-                    'actors_names': [],
-                    'writers_names': [],
-                    'directors_names': []
-                })
-                if film['persons'] is not None:
-                    for person in film['persons']:
-                        if person['id'] in persons_docs_raw:
-                            persons_docs_raw[person['id']
-                                             ]['role'].add(person['role'])
-                            persons_docs_raw[person['id']
-                                             ]['film_ids'].add(film['id'])
-                        else:
-                            persons_docs_raw[person['id']] = {
-                                'id': person['id'],
-                                'full_name': person['full_name'],
-                                'role': set([person['role']]),
-                                'film_ids': set([film['id']])
+            )
+            logger.info(f'Extracted {len(genres)} genres from database')
+            time.sleep(self.throttle)
+            if genres:
+                target.send(genres)
+
+    @coroutine
+    def transform_for_elastic(self, target: Generator):
+        genres: List[dict]
+        while genres := (yield):
+            genre_docs = [
+                {
+                    'id': genre['id'],
+                    'name': genre['name'],
+                    'description': genre['description']
+                } for genre in genres
+            ]
+            target.send(genre_docs)
+
+
+PERSON_RENAME_SCRIPT = '''
+boolean changed = false;
+for (String field : params.fields) {
+    List persons = ctx._source[field];
+    if (persons == null) {
+        continue;
+    }
+    List names = new ArrayList();
+    for (Map person : persons) {
+        String name = params.names.get(person.id);
+        if (name != null && !name.equals(person.name)) {
+            person.name = name;
+            changed = true;
+        }
+        names.add(person.name);
+    }
+    ctx._source[field + '_names'] = names;
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+'''
+
+
+@dataclass
+class ETLProcessPersonRename(ETLProcess):
+    """
+    Переносит изменения имён персон в индекс movies.
+    Вместо повторного извлечения всех фильмов персоны обновляет
+    в elastic только вложенные actors/writers/directors с её id
+    и соответствующие массивы *_names.
+    Изменения состава участников фильма приходят через person_film_role
+    и обрабатываются полным извлечением фильма.
+    """
+    person_fields: Tuple[str, ...] = ('actors', 'writers', 'directors')
+
+    @coroutine
+    def extract(self, target: Generator):
+        person_ids: List[str]
+        while person_ids := (yield):
+            persons: List[dict] = self.query(
+                '''
+                SELECT person.id, person.full_name
+                FROM content.person person
+                WHERE person.id = ANY(%(person_ids)s::uuid[]);
+                ''',
+                {
+                    'person_ids': person_ids
+                }
+            )
+            logger.info(f'Extracted {len(persons)} renamed persons from database')
+            time.sleep(self.throttle)
+            if persons:
+                target.send(persons)
+
+    @coroutine
+    def transform_for_elastic(self, target: Generator):
+        persons: List[dict]
+        while persons := (yield):
+            ETL_ROWS.labels(self.name, 'extract').inc(len(persons))
+            target.send({person['id']: person['full_name'] for person in persons})
+
+    @backoff.on_exception(backoff.expo, Exception)
+    def _bulk_update_elastic(self, names: Dict[str, str]) -> Tuple[int, list]:
+        with get_elastic(self.config, timeout=300) as es, self._measure_bulk(len(names)):
+            result = es.update_by_query(
+                index=self.index, body=self._rename_query(names),
+                conflicts='proceed')
+            if result['version_conflicts']:
+                es.indices.refresh(index=self.index)
+        return self._check_rename_result(result)
+
+    async def _bulk_update_elastic_async(self, es: AsyncElasticsearch,
+                                         names: Dict[str, str]) -> Tuple[int, list]:
+        with self._measure_bulk(len(names)):
+            result = await es.update_by_query(
+                index=self.index, body=self._rename_query(names),
+                conflicts='proceed', request_timeout=300)
+            if result['version_conflicts']:
+                await es.indices.refresh(index=self.index)
+        return self._check_rename_result(result)
+
+    def _check_rename_result(self, result: dict) -> Tuple[int, list]:
+        ES_BULK_ERRORS.labels(self.index).inc(
+            len(result['failures']) + result['version_conflicts'])
+        if result['version_conflicts']:
+            # фильм изменили между поиском и обновлением, и его пропустили
+            # со старым именем. Индекс обновлён, повторный запрос через backoff
+            # увидит новую версию; чекпоинт до этого не сохраняется
+            raise RuntimeError(
+                f"{result['version_conflicts']} documents in '{self.index}' "
+                f"changed during person rename")
+        return result['updated'], result['failures']
+
+    @staticmethod
+    def merge_payloads(payloads: List[Dict[str, str]]) -> Dict[str, str]:
+        # transform отдаёт не документы, а новые имена по id персон
+        names: Dict[str, str] = {}
+        for payload in payloads:
+            names.update(payload)
+        return names
+
+    def publish_changes(self, names: Dict[str, str]) -> None:
+        # рейтинги от имён персон не зависят, снимкам в API нужны id фильмов
+        if not names or self.change_feed is None:
+            return
+        rows = self.db.query(
+            '''
+            SELECT DISTINCT film_id::text AS film_id
+            FROM content.person_film_role
+            WHERE person_id = ANY(%(person_ids)s::uuid[]);
+            ''',
+            {
+                'person_ids': list(names)
+            }
+        )
+        self.change_feed.publish(self.index, [row['film_id'] for row in rows])
+
+    def _rename_query(self, names: Dict[str, str]) -> dict:
+        person_ids = list(names)
+        return {
+            'query': {
+                'bool': {
+                    'should': [
+                        {
+                            'nested': {
+                                'path': field,
+                                'query': {
+                                    'terms': {f'{field}.id': person_ids}
+                                }
                             }
+                        } for field in self.person_fields
+                    ],
+                    'minimum_should_match': 1
+                }
+            },
+            'script': {
+                'lang': 'painless',
+                'source': PERSON_RENAME_SCRIPT,
+                'params': {
+                    'fields': list(self.person_fields),
+                    'names': names
+                }
+            }
+        }
 
-                        if person['role'] == 'director':
-                            film_work_doc['directors_names'].append(
-                                person['full_name'])
-                            film_work_doc['directors'].append(
-                                {'id': person['id'],
-                                    'name': person['full_name']}
-                            )
-                        if person['role'] == 'actor':
-                            film_work_doc['actors_names'].append(
-                                person['full_name'])
-                            film_work_doc['actors'].append(
-                                {'id': person['id'],
-                                    'name': person['full_name']}
-                            )
-                        if person['role'] == 'writer':
-                            film_work_doc['writers_names'].append(
-                                person['full_name'])
-                            film_work_doc['writers'].append(
-                                {'id': person['id'],
-                                    'name': person['full_name']}
-                            )
-                film_work_docs.append(film_work_doc)
-            genre_docs = [genre_doc for genre_doc in genre_docs_raw.values()]
-
-            if self.index == 'genre':
-                target.send(genre_docs)
-            elif self.index == 'movies':
-                target.send(film_work_docs)
+
+# индекс (он же алиас, из которого читает API) ->
+# (файл с маппингом, основная таблица, процесс ETL)
+INDEX_SOURCES = {
+    'movies': ('filmwork.json', 'content.film_work', ETLProcessFilmWork),
+    'genre': ('genre.json', 'content.genre', ETLProcessGenre),
+    'persons': ('persons.json', 'content.person', ETLProcessPerson),
+}
+
+
+@dataclass
+class IndexManager:
+    """Создание версионных индексов из etl/index_elastic и переключение алиасов"""
+    es: Elasticsearch
+    mappings_dir: str = INDEX_MAPPINGS_DIR
+
+    def load_index_body(self, alias: str) -> dict:
+        mapping_file, _, _ = INDEX_SOURCES[alias]
+        with open(os.path.join(self.mappings_dir, mapping_file)) as f:
+            return json.load(f)
+
+    def get_alias_indices(self, alias: str) -> List[str]:
+        if not self.es.indices.exists_alias(name=alias):
+            return []
+        return list(self.es.indices.get_alias(name=alias))
+
+    def get_replicas(self, alias: str, default: int = 1) -> int:
+        """Количество реплик у индекса, который сейчас стоит за алиасом"""
+        if not self.es.indices.exists(index=alias):
+            return default
+        settings = self.es.indices.get_settings(
+            index=alias, name='index.number_of_replicas')
+        for index_settings in settings.values():
+            return int(index_settings['settings']['index']['number_of_replicas'])
+        return default
+
+    @staticmethod
+    def mapping_hash(body: dict) -> str:
+        """Хэш содержимого файла с маппингом, меняется при любой правке"""
+        raw = json.dumps(body, sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+    def get_mapping_hash(self, alias: str) -> Optional[str]:
+        """Хэш маппинга, из которого создан индекс за алиасом"""
+        if not self.es.indices.exists(index=alias):
+            return None
+        for index_mapping in self.es.indices.get_mapping(index=alias).values():
+            meta = index_mapping.get('mappings', {}).get('_meta', {})
+            return meta.get('mapping_hash')
+        return None
+
+    def check_index(self, alias: str) -> str:
+        """
+        Сравнить индекс с маппингом из файла:
+        'missing' - индекса нет, 'drift' - маппинг изменился, 'ok' - совпадает
+        """
+        if not self.es.indices.exists(index=alias):
+            return 'missing'
+        body = self.load_index_body(alias)
+        if self.get_mapping_hash(alias) != self.mapping_hash(body):
+            return 'drift'
+        return 'ok'
+
+    def create_versioned_index(self, alias: str, body: dict) -> str:
+        """Создать новый индекс с настройками для массовой загрузки"""
+        mapping_hash = self.mapping_hash(body)
+        index = f'{alias}_{mapping_hash}_{time.strftime("%Y%m%d%H%M%S")}'
+        body = copy.deepcopy(body)
+        settings = body.setdefault('settings', {})
+        settings['refresh_interval'] = '-1'
+        settings['number_of_replicas'] = 0
+        body.setdefault('mappings', {})['_meta'] = {'mapping_hash': mapping_hash}
+        self.es.indices.create(index=index, body=body)
+        logger.info(f"Created index '{index}' for alias '{alias}'")
+        return index
+
+    def finalize_index(self, index: str, body: dict, replicas: int) -> None:
+        """Вернуть рабочие настройки после загрузки и слить сегменты"""
+        refresh_interval = body.get('settings', {}).get('refresh_interval', '1s')
+        self.es.indices.put_settings(index=index, body={
+            'index': {
+                'refresh_interval': refresh_interval,
+                'number_of_replicas': replicas
+            }
+        })
+        self.es.indices.refresh(index=index)
+        self.es.indices.forcemerge(
+            index=index, max_num_segments=1, request_timeout=3600)
+
+    def swap_alias(self, alias: str, index: str) -> List[str]:
+        """Атомарно перевести алиас на новый индекс, вернуть старые индексы"""
+        old_indices = self.get_alias_indices(alias)
+        actions = [
+            {'remove': {'index': old, 'alias': alias}} for old in old_indices
+        ]
+        if not old_indices and self.es.indices.exists(index=alias):
+            # индекс создавался вручную под именем алиаса,
+            # удаляем его в той же операции, что и добавляем алиас
+            actions.append({'remove_index': {'index': alias}})
+        actions.append({'add': {'index': index, 'alias': alias}})
+        self.es.indices.update_aliases(body={'actions': actions})
+        logger.info(f"Alias '{alias}' now points to '{index}'")
+        return old_indices
+
+
+@dataclass
+class Reindexer:
+    """
+    Полная перестройка индекса без простоя: данные заливаются в новый
+    версионный индекс, после чего алиас атомарно переключается на него.
+    """
+    db: PostgresDatabase
+    config: ETLConfig
+    indices: IndexManager
+    hash_store: DocumentHashStore = None
+    transform_pool: Executor = None
+    leaderboard: FilmLeaderboard = None
+
+    def bootstrap(self, reindex_on_drift: bool = True) -> None:
+        """
+        Проверить индексы при старте ETL: отсутствующие создать и заполнить,
+        индексы с устаревшим маппингом перестроить без простоя
+        """
+        for alias in INDEX_SOURCES:
+            status = self.indices.check_index(alias)
+            if status == 'ok':
+                continue
+            if status == 'drift' and not reindex_on_drift:
+                logger.warning(
+                    f"Mapping of '{alias}' differs from etl/index_elastic, "
+                    "run 'reindex' to apply it")
+                continue
+            logger.info(f"Index '{alias}' is {status}, rebuilding it")
+            self.run(alias)
+        if self.leaderboard is not None and not self.leaderboard.is_built():
+            logger.info('Film leaderboard is missing or outdated, building it')
+            self.build_leaderboard()
+
+    def build_leaderboard(self) -> None:
+        """Заново построить рейтинги фильмов в redis из postgres"""
+        process = ETLProcessFilmWork(
+            db=self.db, config=self.config, lookup=None, index='movies',
+            throttle=0, transform_pool=self.transform_pool,
+            transform_chunk_size=self.config.transform_chunk_size
+        )
+        count = self.leaderboard.rebuild(
+            process.transform_batch(ids) for ids in self._iter_ids('content.film_work'))
+        logger.info(f'Film leaderboard built from {count} film works')
+
+    def run(self, alias: str) -> str:
+        _, table, process_class = INDEX_SOURCES[alias]
+        body = self.indices.load_index_body(alias)
+        replicas = self.indices.get_replicas(alias)
+        started_at = self._now()
+
+        index = self.indices.create_versioned_index(alias, body)
+        process = process_class(
+            db=self.db, config=self.config, lookup=None, index=index,
+            throttle=0, transform_pool=self.transform_pool,
+            transform_chunk_size=self.config.transform_chunk_size
+        )
+        loaded = self._load(process, self._iter_ids(table))
+        # строки, изменённые во время перестройки, могли быть прочитаны
+        # до изменения - догружаем их ещё раз через те же lookup'ы,
+        # что и живой ETL, включая связанные таблицы (жанры, персоны, роли)
+        caught_up_at = self._now()
+        loaded += self._load(process, self._iter_changed_ids(alias, started_at))
+        logger.info(f"Loaded {loaded} documents into '{index}'")
+
+        self.indices.finalize_index(index, body, replicas)
+        # пока сливались сегменты, живой ETL продолжал писать в старый индекс -
+        # догружаем изменения с начала первой догрузки прямо перед переключением
+        loaded = self._load(process, self._iter_changed_ids(alias, caught_up_at))
+        logger.info(f"Caught up {loaded} documents changed while finalizing '{index}'")
+        old_indices = self.indices.swap_alias(alias, index)
+        if self.hash_store is not None:
+            # хэши относились к старому индексу
+            self.hash_store.reset(alias)
+        for old_index in old_indices:
+            self.indices.es.indices.delete(index=old_index)
+            logger.info(f"Deleted old index '{old_index}'")
+        if alias == 'movies' and self.leaderboard is not None:
+            self.build_leaderboard()
+        return index
+
+    def _now(self) -> Any:
+        """Время по часам базы, с ним сравниваются modified в lookup'ах"""
+        return self.db.query('SELECT now() AS now;', {})[0]['now']
+
+    def _load(self, process: ETLProcess, batches: Iterable[List[str]]) -> int:
+        loaded = 0
+        with get_elastic(self.config, timeout=60) as es:
+            for ok, info in helpers.parallel_bulk(
+                    es,
+                    self._generate_actions(process, batches),
+                    thread_count=self.config.reindex_threads,
+                    chunk_size=self.config.reindex_batch_size
+            ):
+                if not ok:
+                    raise RuntimeError(f'Failed to index document: {info}')
+                loaded += 1
+        return loaded
+
+    @staticmethod
+    def _generate_actions(process: ETLProcess, batches: Iterable[List[str]]) -> Generator:
+        for ids in batches:
+            yield from process.generate_actions(process.transform_batch(ids))
+
+    def _changes_lookup(self, alias: str, since: Any):
+        """Lookup'ы индекса, как в живом ETL, но с чекпоинтом в памяти с момента since"""
+        lookup_params = {
+            'db': self.db,
+            'storage': MemoryStorage({'last_updated_at': str(since)}),
+        }
+        if alias == 'movies':
+            return FilmChangeSetLookup(lookups=[
+                GenreLookup(**lookup_params),
+                PersonFilmRoleLookup(**lookup_params),
+                PersonFilmLookup(**lookup_params),
+                FilmWorkLookup(**lookup_params),
+            ])
+        if alias == 'genre':
+            return GenreLookupGenreETL(**lookup_params)
+        return PersonLookupPersonETL(**lookup_params)
+
+    def _iter_changed_ids(self, alias: str, since: Any) -> Generator:
+        """Id документов, затронутых изменениями после since, пачками"""
+        lookup = self._changes_lookup(alias, since)
+        lookups = getattr(lookup, 'lookups', [lookup])
+        while True:
+            cursors = [item._cursor for item in lookups]
+            batches: List[List[str]] = []
+            lookup.produce(self._collect_batches(batches))
+            yield from batches
+            # lookup читает одну пачку за вызов, пока чекпоинты двигаются - есть ещё
+            if [item._cursor for item in lookups] == cursors:
+                return
+
+    @staticmethod
+    @coroutine
+    def _collect_batches(batches: List[List[str]]):
+        while True:
+            ids = yield
+            if ids:
+                batches.append(list(ids))
+
+    def _iter_ids(self, table: str) -> Generator:
+        """Все id таблицы пачками, с постраничной выборкой по ключу"""
+        last_id = None
+        while True:
+            rows = self.db.query(
+                f'''
+                SELECT id FROM {table}
+                WHERE (%(last_id)s::uuid IS NULL OR id > %(last_id)s::uuid)
+                ORDER BY id
+                LIMIT %(batch_size)s;
+                ''', {
+                    'last_id': last_id,
+                    'batch_size': self.config.reindex_batch_size
+                }
+            )
+            if not rows:
+                return
+            ids = [row['id'] for row in rows]
+            yield ids
+            last_id = ids[-1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='ETL из postgres в elasticsearch')
+    commands = parser.add_subparsers(dest='command')
+    reindex = commands.add_parser(
+        'reindex',
+        help='полностью перестроить индексы и переключить на них алиасы'
+    )
+    reindex.add_argument(
+        'indices', nargs='*', metavar='index',
+        help=f'индексы для перестройки: {", ".join(INDEX_SOURCES)} (по умолчанию все)'
+    )
+    args = parser.parse_args()
+    unknown = set(getattr(args, 'indices', None) or ()) - set(INDEX_SOURCES)
+    if unknown:
+        parser.error(f'unknown indices: {", ".join(sorted(unknown))}')
+    return args
+
+
+@dataclass
+class AsyncETLPipeline:
+    """
+    Асинхронный режим процесса ETL: поиск изменений, extract+transform
+    и загрузка в elastic работают одновременно и связаны очередями
+    ограниченного размера. Пока батч N загружается в elastic,
+    батч N+1 уже извлекается из postgres.
+    Чекпоинты сохраняются строго в порядке батчей и только после загрузки.
+    """
+    process: ETLProcess
+    queue_size: int = 2
+
+    async def run(self) -> None:
+        lookup = self.process.lookup
+        lookup.defer_checkpoint = True
+        extract_queue = asyncio.Queue(self.queue_size)
+        load_queue = asyncio.Queue(self.queue_size)
+        es = get_async_elastic(self.process.config)
+        try:
+            await asyncio.gather(
+                self._produce(extract_queue),
+                self._transform(extract_queue, load_queue),
+                self._load(es, load_queue),
+            )
+        finally:
+            await es.close()
+
+    def _next_batch(self) -> Tuple[List[str], Any]:
+        ids: List[str] = []
+        self.process.lookup.produce(self._collect_ids(ids))
+        return ids, self.process.lookup.take_pending()
+
+    @coroutine
+    def _collect_ids(self, ids: List[str]):
+        while True:
+            ids.extend((yield) or ())
+
+    @staticmethod
+    async def _run_in_span(span: trace.Span, func: Callable, *args) -> Any:
+        """
+        Выполнить func в пуле потоков внутри спана батча.
+        run_in_executor не переносит контекст в поток, копируем его явно.
+        """
+        loop = asyncio.get_running_loop()
+        with trace.use_span(span):
+            return await loop.run_in_executor(
+                None, contextvars.copy_context().run, func, *args)
+
+    async def _produce(self, queue: asyncio.Queue) -> None:
+        while True:
+            # стадии батча идут в разных задачах, поэтому спан батча
+            # передаётся по очередям вместе с ним и закрывается в _load
+            span = tracer.start_span('etl batch', attributes={
+                'etl.process': self.process.name, 'etl.index': self.process.index})
+            ids, checkpoint = await self._run_in_span(span, self._next_batch)
+            if not ids and not checkpoint:
+                span.end()
+                break
+            await queue.put((ids, checkpoint, span))
+        await queue.put(None)
+
+    async def _transform(self, in_queue: asyncio.Queue,
+                         out_queue: asyncio.Queue) -> None:
+        while (item := await in_queue.get()) is not None:
+            ids, checkpoint, span = item
+            docs = []
+            if ids:
+                docs = await self._run_in_span(
+                    span, self.process.transform_batch, ids)
+            await out_queue.put((docs, checkpoint, span))
+        await out_queue.put(None)
+
+    async def _load(self, es: AsyncElasticsearch, queue: asyncio.Queue) -> None:
+        process = self.process
+        while (item := await queue.get()) is not None:
+            docs, checkpoint, span = item
+            try:
+                if docs:
+                    total = len(docs)
+                    docs, hashes = await self._run_in_span(
+                        span, process.filter_unchanged, docs)
+                    docs_updated = 0
+                    if docs:
+                        with trace.use_span(span):
+                            docs_updated, _ = await self._bulk(es, docs)
+                        await self._run_in_span(span, process.publish_changes, docs)
+                    await self._run_in_span(span, process.save_hashes, hashes)
+                    process.log_loaded(docs_updated, total - len(docs))
+                await self._run_in_span(
+                    span, process.lookup.commit_taken, checkpoint)
+            finally:
+                span.end()
+
+    @backoff.on_exception(backoff.expo, Exception)
+    async def _bulk(self, es: AsyncElasticsearch, docs: Any) -> Tuple[int, list]:
+        return await self.process._bulk_update_elastic_async(es, docs)
 
 
 @dataclass
 class ETLManager:
     processes: List[ETLProcess]
     run_once: bool = False
+    listener: ChangeListener = None
+    # запускать процессы в асинхронном режиме (AsyncETLPipeline)
+    run_async: bool = False
+    queue_size: int = 2
+
+    def __post_init__(self):
+        # отставание считается при каждом сборе метрик, а не при опросе таблиц:
+        # если загрузка зависла, lookup'ы не запускаются, а отставание растёт
+        for process in self.processes:
+            lookup = process.lookup
+            for item in getattr(lookup, 'lookups', [lookup]):
+                FRESHNESS_LAG.labels(item.name).set_function(item.freshness_lag)
 
     def loop_processes(self):
-        while True:
-            logger.debug("start")
+        try:
+            while True:
+                logger.debug("start")
+                for process in self.processes:
+                    if self.run_async:
+                        asyncio.run(AsyncETLPipeline(
+                            process, queue_size=self.queue_size).run())
+                    else:
+                        process.run()
+
+                if self.run_once:
+                    break
+                logger.debug("end")
+                if self.listener is not None:
+                    # просыпаемся сразу, как только postgres сообщит об изменении
+                    self.listener.wait(3)
+                else:
+                    time.sleep(3)
+        finally:
+            # при checkpoint_every > 1 часть чекпоинтов ещё только в памяти
             for process in self.processes:
-                process.run()
-
-            if self.run_once:
-                break
-            logger.debug("end")
-            time.sleep(3)
+                process.lookup.flush_state()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     config = ETLConfig()
 
     db = PostgresDatabase(url=config.db_url)
+
+    transform_pool = None
+    if config.transform_workers > 1:
+        transform_pool = ProcessPoolExecutor(config.transform_workers)
+    process_params = {
+        'db': db,
+        'config': config,
+        'transform_pool': transform_pool,
+        'transform_chunk_size': config.transform_chunk_size
+    }
+
     redis = RedisCluster(startup_nodes=[
         {"host": "redis-node-0", "port": "6379"},
         {"host": "redis-node-1", "port": "6380"},
@@ -559,24 +1908,71 @@ if __name__ == "__main__":
     storage = RedisStorage(
         redis
     )
-
-    lookup_params = {'db': db, 'storage': storage}
+    hash_store = DocumentHashStore(redis) if config.doc_hash_enabled else None
+    leaderboard = FilmLeaderboard(redis) if config.leaderboard_enabled else None
+    change_feed = SnapshotChangeFeed(redis) if config.snapshot_feed_enabled else None
+
+    with get_elastic(config) as es:
+        reindexer = Reindexer(db=db, config=config,
+                              indices=IndexManager(es),
+                              hash_store=hash_store,
+                              transform_pool=transform_pool,
+                              leaderboard=leaderboard)
+        if args.command == 'reindex':
+            for alias in args.indices or INDEX_SOURCES:
+                reindexer.run(alias)
+            sys.exit(0)
+        # индексы создаются из etl/index_elastic до первой загрузки,
+        # иначе elastic создаст их сам с маппингом по умолчанию
+        reindexer.bootstrap(reindex_on_drift=config.reindex_on_drift)
+
+    if config.metrics_port:
+        start_http_server(config.metrics_port)
+
+    listener = None
+    if config.cdc_enabled:
+        listener = ChangeListener(url=config.db_url)
+        listener.install_triggers()
+        # начинаем слушать до первого опроса, чтобы не потерять изменения
+        listener.poll()
+
+    lookup_params = {
+        'db': db,
+        'storage': storage,
+        'checkpoint_every': config.checkpoint_every,
+        'listener': listener
+    }
+    movies_lookup = FilmChangeSetLookup(lookups=[
+        GenreLookup(**lookup_params),
+        PersonFilmRoleLookup(**lookup_params),
+        FilmWorkLookup(**lookup_params),
+    ])
     processes = [
-        ETLProcessFilmWork(db=db, config=config, lookup=PersonLookup(
-            **lookup_params), index='movies'),
-        ETLProcessFilmWork(db=db, config=config, lookup=GenreLookup(
-            **lookup_params), index='movies'),
-        ETLProcessFilmWork(db=db, config=config, lookup=PersonFilmRoleLookup(
-            **lookup_params), index='movies'),
-        ETLProcessFilmWork(db=db, config=config, lookup=FilmWorkLookup(
-            **lookup_params), index='movies'),
-        ETLProcessFilmWork(db=db, config=config,
-                           lookup=GenreLookup(
-                               **lookup_params, path_redis='index_genre_lookup_state'),
-                           index='genre'),
-        ETLProcessPerson(db=db, config=config, lookup=PersonLookupPersonETL(
-            **lookup_params), index='persons')
+        ETLProcessFilmWork(**process_params,
+                           lookup=movies_lookup, index='movies',
+                           hash_store=hash_store, leaderboard=leaderboard,
+                           change_feed=change_feed),
+        ETLProcessGenre(**process_params,
+                        lookup=GenreLookupGenreETL(
+                            **lookup_params, path_redis='index_genre_lookup_state'),
+                        index='genre', hash_store=hash_store, change_feed=change_feed),
+        ETLProcessPerson(**process_params, lookup=PersonLookupPersonETL(
+            **lookup_params), index='persons', hash_store=hash_store,
+            change_feed=change_feed),
+        # продолжает с чекпоинта прежнего PersonLookup индекса movies
+        ETLProcessPersonRename(**process_params,
+                               lookup=PersonLookupPersonETL(
+                                   **lookup_params, path_redis='PersonLookup_state'),
+                               index='movies', change_feed=change_feed)
     ]
 
-    manager = ETLManager(processes=processes, run_once=config.run_once)
-    manager.loop_processes()
+    manager = ETLManager(processes=processes, run_once=config.run_once,
+                         listener=listener, run_async=config.async_pipeline,
+                         queue_size=config.pipeline_queue_size)
+    tracer_provider = setup_tracing(config)
+    try:
+        manager.loop_processes()
+    finally:
+        if tracer_provider is not None:
+            # отправить спаны, ещё не ушедшие в экспортёр
+            tracer_provider.shutdown()
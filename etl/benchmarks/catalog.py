@@ -0,0 +1,211 @@
+"""
+Генератор синтетического каталога для таблиц content.*.
+
+Заполняет базу фильмами, персонами и жанрами с правдоподобными
+распределениями: у большинства фильмов небольшой состав и один-два жанра,
+небольшая часть персон снимается очень часто, жанры неравномерно популярны.
+Данные пишутся через COPY порциями, поэтому память не растёт с объёмом
+каталога. Запуск из корня репозитория:
+
+    $ python -m etl.benchmarks.catalog --films 100000 --persons 50000 --truncate
+
+COPY вызывает триггеры, поэтому при CDC_ENABLED каждая строка
+станет уведомлением - каталог лучше генерировать до установки триггеров.
+"""
+import argparse
+import bisect
+import io
+import itertools
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import psycopg2
+
+from etl import ETLConfig
+
+TABLES = (
+    'content.film_work_type',
+    'content.genre',
+    'content.person',
+    'content.film_work',
+    'content.film_work_genre',
+    'content.person_film_role',
+)
+COLUMNS = {
+    'content.film_work_type': ('created', 'modified', 'id', 'name'),
+    'content.genre': ('created', 'modified', 'id', 'name', 'description'),
+    'content.person': ('created', 'modified', 'id', 'full_name'),
+    'content.film_work': ('created', 'modified', 'id', 'title', 'description',
+                          'creation_date', 'certificate', 'file_path', 'rating', 'type_id'),
+    # id - serial, заполняется последовательностью
+    'content.film_work_genre': ('created', 'modified', 'filmwork_id', 'genre_id'),
+    'content.person_film_role': ('created', 'modified', 'id', 'role', 'film_id', 'person_id'),
+}
+FILM_TYPES = (('movie', 0.8), ('tv_show', 0.2))
+WORDS = ('star', 'night', 'love', 'war', 'city', 'dark', 'return', 'last',
+         'secret', 'river', 'king', 'winter', 'dream', 'storm', 'road')
+
+
+def escape(value) -> str:
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyBuffer:
+    """Накапливает строки одной таблицы и сбрасывает их в postgres через COPY"""
+
+    def __init__(self, cursor, table: str, flush_rows: int):
+        self.cursor = cursor
+        self.table = table
+        self.flush_rows = flush_rows
+        self.buffer = io.StringIO()
+        self.rows = 0
+        self.total = 0
+
+    def write(self, *values) -> None:
+        self.buffer.write('\t'.join(escape(v) for v in values) + '\n')
+        self.rows += 1
+        if self.rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        self.buffer.seek(0)
+        self.cursor.copy_expert(
+            f'COPY {self.table} ({", ".join(COLUMNS[self.table])}) FROM STDIN',
+            self.buffer)
+        self.total += self.rows
+        self.buffer = io.StringIO()
+        self.rows = 0
+
+
+class WeightedChoice:
+    """Выбор по весам за O(log n) через накопленные веса"""
+
+    def __init__(self, items: List[str], weights: List[float], rnd: random.Random):
+        self.items = items
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.random = rnd
+
+    def sample(self, count: int) -> List[str]:
+        """count разных элементов, популярные попадаются чаще"""
+        count = min(count, len(self.items))
+        chosen: Dict[str, None] = {}
+        total = self.cum_weights[-1]
+        while len(chosen) < count:
+            index = bisect.bisect(self.cum_weights, self.random.random() * total)
+            chosen[self.items[min(index, len(self.items) - 1)]] = None
+        return list(chosen)
+
+
+def generate(connection, films: int, persons: int, genres: int,
+             seed: int = 0, flush_rows: int = 50000) -> Dict[str, int]:
+    rnd = random.Random(seed)
+    new_id = lambda: str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+    # изменения растянуты на последний год, чтобы ETL читал их по порядку
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    total_rows = films + persons + genres
+    step = timedelta(days=365) / max(total_rows, 1)
+    clock = itertools.count()
+    timestamp = lambda: start + step * next(clock)
+
+    with connection.cursor() as cursor:
+        buffers = {table: CopyBuffer(cursor, table, flush_rows) for table in TABLES}
+
+        type_ids = []
+        for name, _ in FILM_TYPES:
+            type_ids.append(new_id())
+            now = timestamp()
+            buffers['content.film_work_type'].write(now, now, type_ids[-1], name)
+
+        genre_ids = []
+        for i in range(genres):
+            genre_ids.append(new_id())
+            now = timestamp()
+            buffers['content.genre'].write(
+                now, now, genre_ids[-1], f'Genre {i}', f'Description of genre {i}')
+        # популярность жанров убывает по закону Ципфа
+        genre_choice = WeightedChoice(
+            genre_ids, [1 / (rank + 1) ** 0.8 for rank in range(genres)], rnd)
+
+        person_ids = []
+        for i in range(persons):
+            person_ids.append(new_id())
+            now = timestamp()
+            buffers['content.person'].write(
+                now, now, person_ids[-1], f'{rnd.choice(WORDS).title()} Person {i}')
+        # небольшая часть персон снимается очень часто
+        person_choice = WeightedChoice(
+            person_ids, [rnd.paretovariate(1.5) for _ in range(persons)], rnd)
+
+        for i in range(films):
+            film_id = new_id()
+            now = timestamp()
+            buffers['content.film_work'].write(
+                now, now, film_id,
+                ' '.join(rnd.sample(WORDS, rnd.randint(1, 4))).title() + f' {i}',
+                ' '.join(rnd.choices(WORDS, k=rnd.randint(20, 80))),
+                (start - timedelta(days=rnd.randint(0, 365 * 80))).date(),
+                rnd.choice(('0+', '6+', '12+', '16+', '18+')),
+                None,
+                round(rnd.uniform(1, 10), 1),
+                rnd.choices(type_ids, [w for _, w in FILM_TYPES])[0],
+            )
+            for genre_id in genre_choice.sample(rnd.choices((1, 2, 3), (50, 35, 15))[0]):
+                buffers['content.film_work_genre'].write(now, now, film_id, genre_id)
+            # у большинства фильмов 5-20 человек, у части - до двухсот
+            cast_size = min(int(rnd.lognormvariate(2.3, 0.6)) + 1, 200)
+            cast = person_choice.sample(cast_size)
+            directors = rnd.randint(1, 2)
+            writers = rnd.randint(1, 3)
+            for position, person_id in enumerate(cast):
+                if position < directors:
+                    role = 'director'
+                elif position < directors + writers:
+                    role = 'writer'
+                else:
+                    role = 'actor'
+                buffers['content.person_film_role'].write(
+                    now, now, new_id(), role, film_id, person_id)
+
+        for buffer in buffers.values():
+            buffer.flush()
+    connection.commit()
+    return {table: buffer.total for table, buffer in buffers.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dsn', default=ETLConfig().db_url)
+    parser.add_argument('--films', type=int, default=100000)
+    parser.add_argument('--persons', type=int, default=50000)
+    parser.add_argument('--genres', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--truncate', action='store_true',
+                        help='очистить таблицы content.* перед генерацией')
+    args = parser.parse_args()
+
+    with psycopg2.connect(args.dsn) as connection:
+        if args.truncate:
+            with connection.cursor() as cursor:
+                cursor.execute(f'TRUNCATE {", ".join(TABLES)};')
+        started = time.perf_counter()
+        rows = generate(connection, args.films, args.persons, args.genres, args.seed)
+        elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(sum(rows.values()) / elapsed, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Бенчмарк пропускной способности ETL.
+
+Запускает ETLProcess'ы индексов movies, genre и persons с нуля (чекпоинты
+хранятся в памяти) против локального postgres с каталогом из
+etl.benchmarks.catalog и заглушки elasticsearch, которая принимает bulk
+и ничего не индексирует. Для каждого процесса печатается строка JSON
+со скоростью (строк в секунду) по стадиям и пиковой памятью.
+Запуск из корня репозитория:
+
+    $ python -m etl.benchmarks.catalog --films 100000 --truncate
+    $ python -m etl.benchmarks.pipeline --es-latency 0.02
+
+Размеры батчей и пул преобразования настраиваются теми же переменными
+окружения, что и ETL (TRANSFORM_WORKERS, TRANSFORM_CHUNK_SIZE, ...).
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from prometheus_client import REGISTRY
+
+import etl
+from etl import (ETLConfig, ETLProcessFilmWork, ETLProcessGenre,
+                 ETLProcessPerson, FilmChangeSetLookup, FilmWorkLookup,
+                 GenreLookup, GenreLookupGenreETL, MemoryStorage,
+                 PersonFilmRoleLookup, PersonLookupPersonETL,
+                 PostgresDatabase)
+
+
+class StubElasticHandler(BaseHTTPRequestHandler):
+    """
+    Отвечает на то, что делает клиент ETL: проверку кластера,
+    sniffing при старте и bulk. Документы только считаются.
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    docs = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        host, port = self.server.server_address[:2]
+        if self.path.startswith('/_nodes'):
+            self._reply({'nodes': {'stub': {
+                'name': 'stub',
+                'roles': ['master', 'data', 'ingest'],
+                'http': {'publish_address': f'{host}:{port}'},
+            }}})
+        else:
+            self._reply({'name': 'stub', 'cluster_name': 'stub',
+                         'version': {'number': '7.10.2',
+                                     'build_flavor': 'default'},
+                         'tagline': 'You Know, for Search'})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        if '_bulk' not in self.path:
+            self._reply({'took': 1, 'updated': 0, 'failures': []})
+            return
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            if not line.strip():
+                continue
+            (operation, meta), = json.loads(line).items()
+            if operation != 'delete':
+                next(lines, None)
+            items.append({operation: {'_index': meta.get('_index'), '_id': meta.get('_id'),
+                                      'status': 200, 'result': 'updated'}})
+        with self.lock:
+            StubElasticHandler.docs += len(items)
+        self._reply({'took': 1, 'errors': False, 'items': items})
+
+    do_PUT = do_POST
+
+
+def start_stub_elastic(latency: float) -> ThreadingHTTPServer:
+    StubElasticHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubElasticHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_process(index: str, db: PostgresDatabase, config: ETLConfig):
+    lookup_params = {'db': db, 'storage': MemoryStorage()}
+    process_params = {'db': db, 'config': config, 'index': index, 'throttle': 0,
+                      'transform_chunk_size': config.transform_chunk_size}
+    if index == 'movies':
+        return ETLProcessFilmWork(**process_params, lookup=FilmChangeSetLookup(lookups=[
+            GenreLookup(**lookup_params),
+            PersonFilmRoleLookup(**lookup_params),
+            FilmWorkLookup(**lookup_params),
+        ]))
+    if index == 'genre':
+        return ETLProcessGenre(**process_params, lookup=GenreLookupGenreETL(**lookup_params))
+    return ETLProcessPerson(**process_params, lookup=PersonLookupPersonETL(**lookup_params))
+
+
+def sample_sum(metric: str, label: str = 'stage') -> Dict[str, float]:
+    """Сумма значений метрики prometheus по значениям метки"""
+    totals: Dict[str, float] = {}
+    for family in REGISTRY.collect():
+        for sample in family.samples:
+            if sample.name == metric:
+                key = sample.labels.get(label, '')
+                totals[key] = totals.get(key, 0) + sample.value
+    return totals
+
+
+def run_process(index: str, dsn: str, elastic_url: str) -> dict:
+    """
+    Выполняется в отдельном процессе, поэтому метрики и пиковая
+    память относятся только к этому ETLProcess
+    """
+    config = ETLConfig(db_url=dsn, elasticsearch_hosts=elastic_url)
+    transform_pool = None
+    if config.transform_workers > 1:
+        transform_pool = ProcessPoolExecutor(config.transform_workers)
+    process = build_process(index, PostgresDatabase(url=dsn), config)
+    process.transform_pool = transform_pool
+
+    started = time.perf_counter()
+    batches = 0
+    while True:
+        # lookup отдаёт один батч за запуск, крутим до конца таблиц
+        before = sum(sample_sum('etl_rows_total').values())
+        process.run()
+        if sum(sample_sum('etl_rows_total').values()) == before:
+            break
+        batches += 1
+    elapsed = time.perf_counter() - started
+    if transform_pool is not None:
+        transform_pool.shutdown()
+
+    rows = sample_sum('etl_rows_total')
+    seconds = sample_sum('etl_stage_seconds_sum')
+    seconds['load'] = sum(sample_sum('etl_elastic_bulk_seconds_sum', 'index').values())
+    stages = {}
+    for stage in ('lookup', 'extract', 'transform', 'load'):
+        stage_rows = int(rows.get(stage, 0))
+        stage_seconds = seconds.get(stage, 0)
+        stages[stage] = {
+            'rows': stage_rows,
+            'seconds': round(stage_seconds, 3),
+            'rows_per_sec': round(stage_rows / stage_seconds, 1) if stage_seconds else None,
+        }
+    return {
+        'process': process.name,
+        'batches': batches,
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(rows.get('load', 0) / elapsed, 1) if elapsed else None,
+        'skipped': int(rows.get('skip', 0)),
+        'stages': stages,
+        # ru_maxrss в linux - в килобайтах
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dsn', default=ETLConfig().db_url)
+    parser.add_argument('--indices', nargs='+', default=['movies', 'genre', 'persons'],
+                        choices=['movies', 'genre', 'persons'])
+    parser.add_argument('--es-latency', type=float, default=0.0,
+                        help='задержка ответа заглушки на bulk, секунды')
+    args = parser.parse_args()
+
+    # пауза между шагами нужна в проде, в замере она только мешает
+    etl.THROTTLE_SECONDS = 0
+    server = start_stub_elastic(args.es_latency)
+    host, port = server.server_address[:2]
+    context = multiprocessing.get_context('fork')
+    try:
+        for index in args.indices:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(
+                    run_process, index, args.dsn, f'http://{host}:{port}').result()
+            print(json.dumps(result))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Бенчмарк стадии преобразования фильмов на синтетических данных.
+
+Показывает, как растёт скорость (документов в секунду)
+с числом процессов в пуле. Запуск из корня репозитория:
+
+    $ python -m etl.benchmarks.transform --films 50000 --workers 1 2 4 8
+
+На каждое число процессов печатается строка JSON.
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from etl import transform_film_works, transform_in_pool
+
+ROLES = ('actor', 'actor', 'actor', 'writer', 'director')
+
+
+def generate_films(count: int, persons: int = 20000, genres: int = 30,
+                   seed: int = 0) -> List[dict]:
+    rnd = random.Random(seed)
+    person_pool = [
+        {'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+         'full_name': f'Person {i}'}
+        for i in range(persons)
+    ]
+    genre_pool = [
+        {'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'name': f'Genre {i}'}
+        for i in range(genres)
+    ]
+    films = []
+    for i in range(count):
+        # у большинства фильмов небольшой состав, у части - очень большой
+        cast_size = min(int(rnd.lognormvariate(2.5, 0.6)), 200)
+        films.append({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'title': f'Film {i}',
+            'description': 'Lorem ipsum dolor sit amet ' * 5,
+            'rating': round(rnd.uniform(1, 10), 1),
+            'persons': [
+                dict(person, role=rnd.choice(ROLES))
+                for person in rnd.sample(person_pool, cast_size)
+            ],
+            'genres': rnd.sample(genre_pool, rnd.randint(1, 3)),
+        })
+    return films
+
+
+def run(films: List[dict], workers: int, batch_size: int,
+        chunk_size: int) -> dict:
+    batches = [films[i:i + batch_size] for i in range(0, len(films), batch_size)]
+    docs = 0
+    if workers == 1:
+        started = time.perf_counter()
+        for batch in batches:
+            docs += len(transform_film_works(batch))
+        elapsed = time.perf_counter() - started
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            # прогрев, чтобы не считать время запуска процессов
+            transform_in_pool(pool, transform_film_works,
+                              batches[0], chunk_size)
+            started = time.perf_counter()
+            for batch in batches:
+                docs += len(transform_in_pool(
+                    pool, transform_film_works, batch, chunk_size))
+            elapsed = time.perf_counter() - started
+    return {
+        'workers': workers,
+        'docs': docs,
+        'seconds': round(elapsed, 3),
+        'docs_per_sec': round(docs / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--films', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=250)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    films = generate_films(args.films)
+    baseline = None
+    for workers in args.workers:
+        result = run(films, workers, args.batch_size, args.chunk_size)
+        baseline = baseline or result['docs_per_sec']
+        result['speedup'] = round(result['docs_per_sec'] / baseline, 2)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+import etl
+from etl import (AsyncETLPipeline, ETLProcessPersonRename, MemoryStorage,
+                 PersonLookupPersonETL)
+
+
+class FakeDatabase:
+    """Отвечает на запросы lookup'а персон и процесса переименования"""
+
+    def __init__(self):
+        self.polled = False
+
+    def query(self, template: str, params: Dict[str, Any]) -> List[dict]:
+        if 'person.full_name' in template:
+            return [{'id': 'p1', 'full_name': 'New Name'}]
+        if 'content.person_film_role' in template:
+            return [{'film_id': 'f1'}, {'film_id': 'f2'}]
+        if 'from content.person' in template:
+            if self.polled:
+                return []
+            self.polled = True
+            return [{'id': 'p1', 'modified': '2021-06-01 12:00:00+00'}]
+        raise AssertionError(f'unexpected query: {template}')
+
+
+class FakeIndices:
+    def __init__(self):
+        self.refreshed: List[str] = []
+
+    async def refresh(self, index: str) -> None:
+        self.refreshed.append(index)
+
+
+class FakeElastic:
+    def __init__(self, version_conflicts: List[int] = ()):
+        self.bodies: List[dict] = []
+        self.indices = FakeIndices()
+        # число конфликтов версий в ответах по порядку, дальше - без конфликтов
+        self.version_conflicts = list(version_conflicts)
+
+    async def update_by_query(self, index: str, body: dict, **kwargs) -> dict:
+        self.bodies.append(body)
+        conflicts = self.version_conflicts.pop(0) if self.version_conflicts else 0
+        return {'updated': 2 - conflicts, 'failures': [], 'version_conflicts': conflicts}
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeChangeFeed:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, index: str, ids: List[str]) -> None:
+        self.published.append((index, ids))
+
+
+class PersonRenameAsyncPipelineTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(etl, 'THROTTLE_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = FakeDatabase()
+        self.storage = MemoryStorage()
+        self.change_feed = FakeChangeFeed()
+        self.process = ETLProcessPersonRename(
+            db=self.db, config=None, index='movies', throttle=0,
+            lookup=PersonLookupPersonETL(db=self.db, storage=self.storage),
+            change_feed=self.change_feed)
+
+    def test_transform_batch_keeps_names(self):
+        self.assertEqual(self.process.transform_batch(['p1']), {'p1': 'New Name'})
+
+    def test_rename_goes_through_async_pipeline(self):
+        es = FakeElastic()
+        with mock.patch.object(etl, 'get_async_elastic', return_value=es):
+            asyncio.run(AsyncETLPipeline(self.process).run())
+
+        self.assertEqual(len(es.bodies), 1)
+        self.assertEqual(es.bodies[0]['script']['params']['names'], {'p1': 'New Name'})
+        self.assertEqual(self.change_feed.published, [('movies', ['f1', 'f2'])])
+        # чекпоинт сохранён только после загрузки
+        self.assertEqual(self.process.lookup.state.get_key('last_id'), 'p1')
+
+    def test_rename_is_retried_on_version_conflicts(self):
+        es = FakeElastic(version_conflicts=[1])
+        with mock.patch.object(etl, 'get_async_elastic', return_value=es), \
+                mock.patch('asyncio.sleep', new=mock.AsyncMock()):
+            asyncio.run(AsyncETLPipeline(self.process).run())
+
+        self.assertEqual(len(es.bodies), 2)
+        self.assertEqual(es.indices.refreshed, ['movies'])
+        self.assertEqual(self.change_feed.published, [('movies', ['f1', 'f2'])])
+        self.assertEqual(self.process.lookup.state.get_key('last_id'), 'p1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import time
+import unittest
+
+from prometheus_client import REGISTRY
+
+from etl import (ETLManager, ETLProcessPerson, FilmChangeSetLookup,
+                 FilmWorkLookup, GenreLookup, MemoryStorage,
+                 PersonLookupPersonETL)
+
+
+def lag(lookup_name: str) -> float:
+    return REGISTRY.get_sample_value('etl_freshness_lag_seconds', {'lookup': lookup_name})
+
+
+class FreshnessLagTest(unittest.TestCase):
+    def setUp(self):
+        params = {'db': None, 'storage': MemoryStorage()}
+        self.persons = PersonLookupPersonETL(**params, path_redis='freshness_persons')
+        self.films = FilmWorkLookup(**params, path_redis='freshness_films')
+        self.genres = GenreLookup(**params, path_redis='freshness_genres')
+        lookup = FilmChangeSetLookup(lookups=[self.films, self.genres])
+        ETLManager(processes=[
+            ETLProcessPerson(db=None, config=None, lookup=self.persons, index='persons'),
+            ETLProcessPerson(db=None, config=None, lookup=lookup, index='movies'),
+        ])
+
+    def test_not_polled_yet(self):
+        self.assertEqual(lag('freshness_persons'), 0)
+
+    def test_lag_grows_while_etl_is_stalled(self):
+        # последний раз всё было загружено 100 секунд назад, с тех пор lookup не запускался
+        self.films.watermark = time.time() - 100
+        first = lag('freshness_films')
+        self.assertGreaterEqual(first, 100)
+        self.films.watermark -= 50
+        self.assertGreaterEqual(lag('freshness_films'), first + 50)
+        self.assertEqual(lag('freshness_genres'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
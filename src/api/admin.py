@@ -0,0 +1,37 @@
+import os
+import secrets
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import ORJSONResponse
+
+from core import config
+from core.slowlog import slow_queries
+
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Служебные маршруты доступны только с токеном из ADMIN_TOKEN
+    в заголовке X-Admin-Token. Без ADMIN_TOKEN их как будто нет.
+    """
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='Not Found')
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail='admin token required')
+
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+
+@router.get('/slow-queries')
+async def slow_queries_report() -> ORJSONResponse:
+    # отпечатки запросов к elastic текущего воркера, самые затратные сверху
+    return ORJSONResponse({'worker': os.getpid(), **slow_queries.snapshot()})
+
+
+@router.delete('/slow-queries')
+async def slow_queries_reset() -> ORJSONResponse:
+    # обнуляет статистику только того воркера, на который попал запрос
+    slow_queries.reset()
+    return ORJSONResponse({'worker': os.getpid(), 'reset': True})
@@ -2,10 +2,13 @@ from enum import Enum
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from models.film import Film, FilmShort
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from models.film import Film
 from services.film import FilmService, get_film_service
 
+from api.v1.responses import json_response
+from core import config
+
 router = APIRouter()
 
 
@@ -24,7 +27,7 @@ async def film_sort_filter(order: Optional[Order] = Order.desc,
                            request: Request = None,
                            film_service: FilmService = Depends(
                                get_film_service)
-                           ) -> Optional[List[FilmShort]]:
+                           ) -> Response:
     """Возвращает короткую информацию по всем фильмам, отсортированным по рейтингу,
      есть возможность фильтровать фильмы по id жанров"""
     films = await film_service.get_by_param(request.url, order=order, genre=genre, page=page, size=size, query=query)
@@ -33,17 +36,17 @@ async def film_sort_filter(order: Optional[Order] = Order.desc,
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='film not found')
 
-    return films
+    return await json_response(request, films, film_service, max_age=config.HTTP_CACHE_MAX_AGE_SHORT)
 
 
 @router.get('/{film_id}', response_model=Film,
             summary='Фильм')
 async def film_details(film_id: str,
                        request: Request = None,
-                       film_service: FilmService = Depends(get_film_service)) -> Film:
+                       film_service: FilmService = Depends(get_film_service)) -> Response:
     """Возвращает информацию по одному фильму"""
     film = await film_service.get_by_id(url=request.url, film_id=film_id)
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='film not found')
-    return film
+    return await json_response(request, film, film_service, max_age=config.HTTP_CACHE_MAX_AGE)
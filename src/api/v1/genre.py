@@ -1,26 +1,23 @@
-import uuid
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from models.genre import GenreShort
 from services.genre import GenreService, get_genre_service
 
-router = APIRouter()
-
+from api.v1.responses import json_response
+from core import config
 
-class Genre(BaseModel):
-    id: uuid.UUID
-    name: str
+router = APIRouter()
 
 
-@router.get('/', response_model=List[Genre],
+@router.get('/', response_model=List[GenreShort],
             summary='Список жанров')
 async def genre_all(size: Optional[int] = 50,
                     page: Optional[int] = 1,
                     request: Request = None,
                     genre_service: GenreService = Depends(get_genre_service)
-                    ) -> Optional[List[Genre]]:
+                    ) -> Response:
     """Возвращает инф-ию по всем жанрам с возможностью пагинации"""
 
     data = await genre_service.get_all(url=request.url, **{'page': page, 'size': size})
@@ -28,17 +25,17 @@ async def genre_all(size: Optional[int] = 50,
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='genre not found')
 
-    return data
+    return await json_response(request, data, genre_service, max_age=config.HTTP_CACHE_MAX_AGE_LONG)
 
 
-@router.get('/{genre_id}', response_model=Genre,
+@router.get('/{genre_id}', response_model=GenreShort,
             summary='Жанр')
 async def genre_details(genre_id: str,
                         request: Request = None,
-                        genre_service: GenreService = Depends(get_genre_service)) -> Genre:
+                        genre_service: GenreService = Depends(get_genre_service)) -> Response:
     """Возвращает информацию по одному жанру"""
     genre = await genre_service.get_by_id(request.url, genre_id)
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='genre not found')
-    return genre
+    return await json_response(request, genre, genre_service, max_age=config.HTTP_CACHE_MAX_AGE_LONG)
@@ -1,12 +1,16 @@
 from http import HTTPStatus
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from models.person import Person
 from models.film import FilmShort
 from services.film import FilmService, get_film_service
 from services.person import PersonService, get_person_service
 
+from api.v1.responses import json_response
+from core import config
+
 router = APIRouter()
 
 
@@ -16,13 +20,13 @@ async def person_details(person_id: str,
                          request: Request = None,
                          person_service: PersonService = Depends(
                              get_person_service)
-                         ) -> Person:
+                         ) -> Response:
     """Возвращает информацию по одной персоне"""
     person = await person_service.get_by_id(request.url, person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='person not found')
-    return person
+    return await json_response(request, person, person_service, max_age=config.HTTP_CACHE_MAX_AGE)
 
 
 @router.get('/{person_id}/films', response_model=List[FilmShort],
@@ -35,7 +39,7 @@ async def films_with_person(person_id: str,
                                 get_person_service),
                             film_service: FilmService = Depends(
                                 get_film_service)
-                            ) -> List[FilmShort]:
+                            ) -> Response:
     """Возвращает список фильмов в которых участвовал персонаж"""
     # отсекаем окончание запроса для получения валидного кэша
     person_url = '/'.join(str(request.url).split('/')[:-1])
@@ -43,6 +47,7 @@ async def films_with_person(person_id: str,
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='person not found')
+    person = orjson.loads(person)
 
     films = await film_service.get_by_list_id(url=request.url,
                                               person_id=person['id'],
@@ -52,7 +57,7 @@ async def films_with_person(person_id: str,
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='film not found')
 
-    return films
+    return await json_response(request, films, film_service, max_age=config.HTTP_CACHE_MAX_AGE)
 
 
 @router.get('/', response_model=List[Person],
@@ -63,7 +68,7 @@ async def person_search(query: Optional[str] = None,
                         request: Request = None,
                         person_service: PersonService = Depends(
                             get_person_service)
-                        ) -> List[Person]:
+                        ) -> Response:
     """Возвращает информацию
     по одному или нескольким персонам"""
 
@@ -73,4 +78,4 @@ async def person_search(query: Optional[str] = None,
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail='person not found')
 
-    return persons
+    return await json_response(request, persons, person_service, max_age=config.HTTP_CACHE_MAX_AGE_SHORT)
@@ -0,0 +1,64 @@
+import hashlib
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import Request, Response
+from services.base import BaseService
+
+from core import config
+from core.compression import choose_encoding
+
+
+def make_etag(body: bytes) -> str:
+    """ETag по содержимому готового тела ответа"""
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """У сжатого представления свой ETag: "<hash>-gzip", "<hash>-br" """
+    if not encoding:
+        return etag
+    return '{}-{}"'.format(etag[:-1], encoding)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверить заголовок If-None-Match, в том числе слабые ETag и '*'.
+    Содержимое сжатого и несжатого представления одно и то же,
+    поэтому суффикс сжатия при сравнении не учитываем.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip().replace('W/', '', 1)
+        if candidate == '*' or candidate == etag:
+            return True
+        base, _, encoding = candidate.rpartition('-')
+        if base and encoding.rstrip('"') in ('gzip', 'br') and f'{base}"' == etag:
+            return True
+    return False
+
+
+async def json_response(request: Request, body: bytes, service: BaseService,
+                        max_age: int = 0) -> Response:
+    """
+    Отдать готовое тело ответа из сервиса без повторной валидации.
+    Если у клиента уже есть такая же версия, отвечаем 304 без тела.
+    Если клиент принимает сжатие, отдаём сжатый вариант из кэша,
+    так что горячие ответы сжимаются один раз.
+    """
+    etag = make_etag(body)
+    encoding = None
+    if len(body) >= config.COMPRESSION_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get('accept-encoding'))
+    headers = {
+        'ETag': encoded_etag(etag, encoding),
+        'Cache-Control': f'public, max-age={max_age}',
+        'Vary': 'Accept-Encoding',
+    }
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    if encoding:
+        body = await service.get_compressed(etag, body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type='application/json', headers=headers)
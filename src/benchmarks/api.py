@@ -0,0 +1,268 @@
+"""
+Бенчмарк API без docker-compose.
+
+Поднимает main.app в этом же процессе поверх заглушек elasticsearch
+и redis (benchmarks.fakes), гоняет смесь запросов к фильмам, персонам
+и жанрам и считает пропускную способность и p50/p95/p99 по каждому
+маршруту для холодного и прогретого кэша. Запуск из каталога src:
+
+    $ python -m benchmarks.api --requests 5000 --concurrency 32 --es-latency 0.005
+
+Результат печатается строками JSON, с --output весь отчёт
+сохраняется в файл для сравнения версий между собой.
+
+С --url запросы идут по http к уже запущенному серверу, например
+к benchmarks.server под gunicorn с разным числом воркеров:
+
+    $ WEB_CONCURRENCY=4 gunicorn benchmarks.server:app -c gunicorn.conf.py
+    $ python -m benchmarks.api --url http://127.0.0.1:8000 --concurrency 256
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+from urllib.parse import urlencode
+
+import aiohttp
+
+from benchmarks.fakes import Catalog, FakeElasticsearch, FakeRedis
+from db import elastic, redis
+
+# доли маршрутов в смеси запросов
+ROUTE_MIX = (
+    ('film_list', 25),
+    ('film_search', 10),
+    ('film_by_genre', 10),
+    ('film_details', 30),
+    ('person_details', 7),
+    ('person_films', 8),
+    ('person_search', 3),
+    ('genre_list', 2),
+    ('genre_details', 5),
+)
+
+
+def popular(rnd: random.Random, items: List[str]) -> str:
+    """Обращения к каталогу неравномерны: небольшая часть собирает почти весь трафик"""
+    index = int(rnd.paretovariate(1.2)) - 1
+    return items[index % len(items)]
+
+
+def generate_requests(catalog: Catalog, count: int,
+                      seed: int = 0) -> List[Tuple[str, str]]:
+    rnd = random.Random(seed)
+    films = list(catalog.films)
+    persons = list(catalog.persons)
+    genres = list(catalog.genres)
+    words = ('star', 'night', 'love', 'war', 'city')
+    routes, weights = zip(*ROUTE_MIX)
+    requests = []
+    for route in rnd.choices(routes, weights, k=count):
+        page = min(int(rnd.paretovariate(2)), 5)
+        if route == 'film_list':
+            url = '/api/v1/film/?' + urlencode({'page': page, 'size': 50})
+        elif route == 'film_search':
+            url = '/api/v1/film/?' + urlencode({'query': rnd.choice(words), 'page': page})
+        elif route == 'film_by_genre':
+            url = '/api/v1/film/?' + urlencode({'genre': popular(rnd, genres), 'page': page})
+        elif route == 'film_details':
+            url = f'/api/v1/film/{popular(rnd, films)}'
+        elif route == 'person_details':
+            url = f'/api/v1/person/{popular(rnd, persons)}'
+        elif route == 'person_films':
+            url = f'/api/v1/person/{popular(rnd, persons)}/films'
+        elif route == 'person_search':
+            url = '/api/v1/person/?' + urlencode({'query': f'Person {rnd.randrange(len(persons))}'})
+        elif route == 'genre_list':
+            url = '/api/v1/genre/'
+        else:
+            url = f'/api/v1/genre/{popular(rnd, genres)}'
+        requests.append((route, url))
+    return requests
+
+
+async def call(app, url: str, accept_encoding: str) -> int:
+    """Вызвать ASGI-приложение напрямую, без сети и http-клиента"""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(b'host', b'benchmark'),
+                    (b'accept-encoding', accept_encoding.encode())],
+        'server': ('benchmark', 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    status = 0
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def call_remote(session: aiohttp.ClientSession, base_url: str, url: str,
+                      accept_encoding: str) -> int:
+    async with session.get(base_url + url,
+                           headers={'Accept-Encoding': accept_encoding}) as response:
+        await response.read()
+        return response.status
+
+
+def percentile(values: List[float], percent: float) -> float:
+    index = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+async def run_phase(caller: Callable[[str], Awaitable[int]],
+                    requests: List[Tuple[str, str]],
+                    concurrency: int) -> Tuple[float, Dict[str, dict]]:
+    queue = asyncio.Queue()
+    for item in requests:
+        queue.put_nowait(item)
+    timings: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+
+    async def worker():
+        while not queue.empty():
+            route, url = queue.get_nowait()
+            started = time.perf_counter()
+            status = await caller(url)
+            timings.setdefault(route, []).append(time.perf_counter() - started)
+            # 404 - нормальный ответ для части запросов (пустая страница, нет фильмов)
+            if status >= 500:
+                errors[route] = errors.get(route, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stats = {}
+    for route, values in sorted(timings.items()):
+        values.sort()
+        stats[route] = {
+            'requests': len(values),
+            'errors': errors.get(route, 0),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+        }
+    return elapsed, stats
+
+
+async def benchmark(args) -> List[dict]:
+    import main
+
+    # подключения к настоящим базам не нужны
+    main.app.router.on_startup.clear()
+    main.app.router.on_shutdown.clear()
+
+    catalog = Catalog(films=args.films, persons=args.persons, genres=args.genres,
+                      seed=args.seed)
+    requests = generate_requests(catalog, args.requests, seed=args.seed)
+    results = []
+    for phase in ('cold', 'warm'):
+        es = FakeElasticsearch(catalog, latency=args.es_latency, jitter=args.es_jitter,
+                               seed=args.seed)
+        cache = FakeRedis(latency=args.redis_latency, enabled=phase == 'warm')
+        elastic.es, redis.redis = es, cache
+        if phase == 'warm':
+            # прогрев: каждый адрес один раз, в замер не попадает
+            for url in {url for _, url in requests}:
+                await call(main.app, url, args.accept_encoding)
+            es.calls.clear()
+
+        async def caller(url: str) -> int:
+            return await call(main.app, url, args.accept_encoding)
+
+        elapsed, stats = await run_phase(caller, requests, args.concurrency)
+        for route, route_stats in stats.items():
+            results.append(dict(phase=phase, route=route, **route_stats))
+        results.append({
+            'phase': phase,
+            'route': 'total',
+            'requests': len(requests),
+            'seconds': round(elapsed, 3),
+            'requests_per_sec': round(len(requests) / elapsed, 1),
+            'elastic_calls': sum(es.calls.values()),
+        })
+    return results
+
+
+async def benchmark_remote(args) -> List[dict]:
+    """Один прогон против запущенного сервера, кэш настраивается на его стороне"""
+    catalog = Catalog(films=args.films, persons=args.persons, genres=args.genres,
+                      seed=args.seed)
+    requests = generate_requests(catalog, args.requests, seed=args.seed)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def caller(url: str) -> int:
+            return await call_remote(session, args.url, url, args.accept_encoding)
+
+        if args.warmup:
+            for url in {url for _, url in requests}:
+                await caller(url)
+        elapsed, stats = await run_phase(caller, requests, args.concurrency)
+    results = [dict(phase='remote', route=route, **route_stats)
+               for route, route_stats in stats.items()]
+    results.append({
+        'phase': 'remote',
+        'route': 'total',
+        'requests': len(requests),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(requests) / elapsed, 1),
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--films', type=int, default=2000)
+    parser.add_argument('--persons', type=int, default=1000)
+    parser.add_argument('--genres', type=int, default=20)
+    parser.add_argument('--es-latency', type=float, default=0.005,
+                        help='задержка ответа elasticsearch, секунды')
+    parser.add_argument('--es-jitter', type=float, default=0.002,
+                        help='случайная добавка к задержке elasticsearch, секунды')
+    parser.add_argument('--redis-latency', type=float, default=0.0)
+    parser.add_argument('--accept-encoding', default='gzip, deflate, br')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='сохранить отчёт в json-файл')
+    parser.add_argument('--url', help='адрес запущенного сервера, например http://127.0.0.1:8000')
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false',
+                        help='с --url: не прогревать кэш сервера перед замером')
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(benchmark_remote(args))
+    else:
+        # логи запросов к elastic искажают замер
+        logging.disable(logging.INFO)
+        results = asyncio.run(benchmark(args))
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as report:
+            json.dump({'config': vars(args), 'results': results}, report, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Заглушки elasticsearch и redis для бенчмарков API.
+
+FakeElasticsearch отдаёт ответы из сгенерированного каталога
+с заданной задержкой, FakeRedis хранит кэш в памяти процесса.
+"""
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from elasticsearch import exceptions
+
+ROLES = ('actors', 'actors', 'actors', 'writers', 'directors')
+
+
+class Catalog:
+    """Синтетический каталог фильмов, персон и жанров"""
+
+    def __init__(self, films: int = 2000, persons: int = 1000,
+                 genres: int = 20, seed: int = 0):
+        rnd = random.Random(seed)
+        new_id = lambda: str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        self.genres: Dict[str, dict] = {}
+        for i in range(genres):
+            genre_id = new_id()
+            self.genres[genre_id] = {'id': genre_id, 'name': f'Genre {i}',
+                                     'description': f'Genre {i} description'}
+        self.persons: Dict[str, dict] = {}
+        for i in range(persons):
+            person_id = new_id()
+            self.persons[person_id] = {'id': person_id, 'full_name': f'Person {i}',
+                                       'role': [], 'film_ids': []}
+        person_ids = list(self.persons)
+        genre_ids = list(self.genres)
+        self.films: Dict[str, dict] = {}
+        for i in range(films):
+            film_id = new_id()
+            film = {
+                'id': film_id,
+                'title': f'Film {i} {rnd.choice(("star", "night", "love", "war", "city"))}',
+                'description': 'Lorem ipsum dolor sit amet ' * 10,
+                'imdb_rating': round(rnd.uniform(1, 10), 1),
+                'genres': [{'id': g, 'name': self.genres[g]['name']}
+                           for g in rnd.sample(genre_ids, rnd.randint(1, 3))],
+                'actors': [], 'writers': [], 'directors': [],
+            }
+            # у большинства фильмов небольшой состав, у части - большой
+            cast_size = min(int(rnd.lognormvariate(2.2, 0.5)) + 1, 60)
+            for person_id in rnd.sample(person_ids, cast_size):
+                role = rnd.choice(ROLES)
+                person = self.persons[person_id]
+                film[role].append({'id': person_id, 'name': person['full_name']})
+                person['film_ids'].append(film_id)
+                if role[:-1] not in person['role']:
+                    person['role'].append(role[:-1])
+            for field in ('genres', 'actors', 'writers', 'directors'):
+                film[f'{field}_names'] = [item['name'] for item in film[field]]
+            self.films[film_id] = film
+        self.indices = {'movies': self.films, 'persons': self.persons,
+                        'genre': self.genres}
+
+
+def _walk(query: dict, key: str) -> List[dict]:
+    """Все вложенные условия с именем key"""
+    found = []
+    if isinstance(query, dict):
+        for name, value in query.items():
+            if name == key:
+                found.append(value)
+            found.extend(_walk(value, key))
+    elif isinstance(query, list):
+        for item in query:
+            found.extend(_walk(item, key))
+    return found
+
+
+class FakeElasticsearch:
+    """
+    Понимает ровно те запросы, которые делают сервисы API:
+    get по id, поиск с фильтром по жанру, полнотекстовый поиск,
+    поиск по списку id и сортировку по рейтингу.
+    """
+
+    def __init__(self, catalog: Catalog, latency: float = 0.005,
+                 jitter: float = 0.0, seed: int = 0):
+        self.catalog = catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: Dict[str, int] = {}
+        self._random = random.Random(seed)
+
+    async def _wait(self, operation: str) -> int:
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        return int(delay * 1000)
+
+    async def get(self, index: str, id: str, **kwargs) -> dict:
+        took = await self._wait('get')
+        doc = self.catalog.indices[index].get(id)
+        if doc is None:
+            raise exceptions.NotFoundError(404, 'not_found', {'found': False})
+        return {'_index': index, '_id': id, 'found': True, '_source': doc, 'took': took}
+
+    async def search(self, index: str, body: Optional[dict] = None, **kwargs) -> dict:
+        took = await self._wait('search')
+        body = body or {}
+        docs = list(self.catalog.indices[index].values())
+        query = body.get('query', {})
+        genres = [m['genres.id'] for m in _walk(query, 'match_phrase') if 'genres.id' in m]
+        if genres:
+            docs = [d for d in docs if any(g['id'] in genres for g in d['genres'])]
+        ids = {m['id'] for m in _walk(query, 'match_phrase') if 'id' in m}
+        if ids:
+            docs = [d for d in docs if d['id'] in ids]
+        for text in [m['query'] for m in _walk(query, 'multi_match')] + \
+                [m['full_name'] for m in _walk(query, 'match') if 'full_name' in m]:
+            words = set(str(text).lower().split())
+            docs = [d for d in docs
+                    if words & set(d.get('title', d.get('full_name', '')).lower().split())]
+        sort = body.get('sort')
+        if sort:
+            order = str(sort['imdb_rating']['order']).lower()
+            docs.sort(key=lambda d: d['imdb_rating'], reverse=order.endswith('desc'))
+        start = body.get('from') or 0
+        size = body.get('size') or 10
+        hits = [{'_index': index, '_id': d['id'], '_source': d} for d in docs[start:start + size]]
+        return {'took': took, 'hits': {'total': {'value': len(docs)}, 'hits': hits}}
+
+    async def close(self):
+        pass
+
+
+class FakeRedis:
+    """
+    Кэш в памяти. С enabled=False ничего не сохраняет,
+    так каждый запрос идёт мимо кэша (холодный прогон).
+    """
+
+    SET_IF_NOT_EXIST = 'SET_IF_NOT_EXIST'
+
+    def __init__(self, latency: float = 0.0, enabled: bool = True):
+        self.latency = latency
+        self.enabled = enabled
+        self.data: Dict[str, bytes] = {}
+        self.expires: Dict[str, float] = {}
+        self.sorted_sets: Dict[str, Dict[str, float]] = {}
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _alive(self, key) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    async def get(self, key, **kwargs):
+        await self._wait()
+        return self.data.get(key) if self._alive(key) else None
+
+    async def set(self, key, value, expire=0, pexpire=0, exist=None, **kwargs):
+        await self._wait()
+        if not self.enabled:
+            return True
+        if exist == self.SET_IF_NOT_EXIST and self._alive(key):
+            return False
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        ttl = expire or pexpire / 1000
+        if ttl:
+            self.expires[key] = time.monotonic() + ttl
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    async def setex(self, key, seconds, value):
+        await self.set(key, value, expire=seconds)
+
+    async def ttl(self, key):
+        await self._wait()
+        if not self._alive(key):
+            return -2
+        expires = self.expires.get(key)
+        return -1 if expires is None else int(expires - time.monotonic())
+
+    async def zadd(self, key, score, member, *pairs, **kwargs):
+        await self._wait()
+        if not self.enabled:
+            return 0
+        members = self.sorted_sets.setdefault(key, {})
+        added = 0
+        for score, member in zip((score, *pairs[::2]), (member, *pairs[1::2])):
+            added += member not in members
+            members[member] = float(score)
+        return added
+
+    async def close(self):
+        pass
@@ -0,0 +1,35 @@
+"""
+main.app с заглушками вместо redis и elasticsearch, для замера
+пропускной способности на нескольких ядрах под gunicorn:
+
+    $ gunicorn benchmarks.server:app -c gunicorn.conf.py
+
+Каждый воркер строит тот же каталог, что и benchmarks.api (одинаковый
+seed), поэтому id в запросах совпадают. Параметры задаются переменными
+окружения BENCH_FILMS, BENCH_PERSONS, BENCH_GENRES, BENCH_SEED,
+BENCH_ES_LATENCY, BENCH_ES_JITTER; BENCH_CACHE=0 отключает кэш.
+"""
+import os
+
+import main
+from benchmarks.fakes import Catalog, FakeElasticsearch, FakeRedis
+from db import elastic, redis
+
+app = main.app
+
+
+async def startup():
+    catalog = Catalog(films=int(os.getenv('BENCH_FILMS', 2000)),
+                      persons=int(os.getenv('BENCH_PERSONS', 1000)),
+                      genres=int(os.getenv('BENCH_GENRES', 20)),
+                      seed=int(os.getenv('BENCH_SEED', 0)))
+    elastic.es = FakeElasticsearch(catalog,
+                                   latency=float(os.getenv('BENCH_ES_LATENCY', 0.005)),
+                                   jitter=float(os.getenv('BENCH_ES_JITTER', 0.002)),
+                                   seed=os.getpid())
+    redis.redis = FakeRedis(enabled=os.getenv('BENCH_CACHE', '1') == '1')
+
+
+# вместо подключения к настоящим базам
+app.router.on_startup = [startup]
+app.router.on_shutdown = []
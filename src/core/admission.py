@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core import config
+from core.metrics import ADMISSION_LIMIT, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# класс маршрута текущего запроса: detail - объект по id, search - списки и поиск
+route_class: ContextVar[str] = ContextVar('route_class', default='search')
+
+DETAIL_PATH = re.compile(r'.*/[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}/?')
+
+
+class Overloaded(Exception):
+    """Бэкенд перегружен, запрос не пропущен к нему"""
+
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f'{backend} is overloaded')
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class AdmissionMiddleware:
+    """Определяет класс маршрута, по нему выбирается лимит обращений к бэкенду"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        detail = not scope.get('query_string') and DETAIL_PATH.fullmatch(scope['path'])
+        token = route_class.set('detail' if detail else 'search')
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.reset(token)
+
+
+class AdaptiveLimiter:
+    """
+    Ограничивает число одновременных обращений к бэкенду.
+    Лимит подбирается по AIMD: пока ответы быстрее target_latency,
+    он растёт на единицу за каждые limit обращений, при медленном
+    ответе или ошибке уменьшается в decrease_factor раз.
+    Сверх лимита запросы ждут в очереди длиной не больше max_queue,
+    остальные сразу получают отказ.
+    """
+
+    def __init__(self, name: str, target_latency: float, initial_limit: float,
+                 min_limit: float, max_limit: float, max_queue: int,
+                 queue_timeout: float, decrease_factor: float = 0.5):
+        self.name = name
+        self.target_latency = target_latency
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.labels(*name.split(':')).set(self.limit)
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= int(self.limit)
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        if not self.saturated and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject('queue_full')
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        wait = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        try:
+            await asyncio.wait_for(waiter, max(wait, 0))
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._reject('queue_timeout')
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # место уже выдано, но запрос отменили - возвращаем его
+                self.release(0, ok=True, adjust=False)
+            raise
+
+    def release(self, latency: float, ok: bool, adjust: bool = True) -> None:
+        utilized = self.in_flight >= self.limit / 2
+        self.in_flight -= 1
+        if adjust:
+            self._adjust(latency, ok, utilized)
+        while self._waiters and not self.saturated:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adjust(self, latency: float, ok: bool, utilized: bool) -> None:
+        if ok and latency <= self.target_latency:
+            # лимит растёт, только если его действительно выбирают
+            if utilized and self.limit < self.max_limit:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                ADMISSION_LIMIT.labels(*self.name.split(':')).set(self.limit)
+            return
+        now = time.monotonic()
+        # пачка медленных ответов на один и тот же всплеск уменьшает лимит один раз
+        if now - self._last_decrease < max(latency, self.target_latency):
+            return
+        self._last_decrease = now
+        new_limit = max(self.limit * self.decrease_factor, self.min_limit)
+        if int(new_limit) < int(self.limit):
+            logger.warning(f'Admission limit for {self.name} lowered to {new_limit:.1f}')
+        self.limit = new_limit
+        ADMISSION_LIMIT.labels(*self.name.split(':')).set(self.limit)
+
+    def _reject(self, reason: str) -> None:
+        ADMISSION_REJECTED.labels(*self.name.split(':'), reason).inc()
+        raise Overloaded(self.name.split(':')[0], config.ADMISSION_RETRY_AFTER)
+
+
+def _make_limiter(backend: str, klass: str, target_latency: float) -> AdaptiveLimiter:
+    return AdaptiveLimiter(f'{backend}:{klass}', target_latency,
+                           initial_limit=config.ADMISSION_INITIAL_LIMIT,
+                           min_limit=config.ADMISSION_MIN_LIMIT,
+                           max_limit=config.ADMISSION_MAX_LIMIT,
+                           max_queue=config.ADMISSION_QUEUE_SIZE,
+                           queue_timeout=config.ADMISSION_QUEUE_TIMEOUT)
+
+
+# лимиты на один процесс (воркер gunicorn)
+elastic_limiters: Dict[str, AdaptiveLimiter] = {
+    'search': _make_limiter('elastic', 'search', config.ELASTIC_TARGET_LATENCY_SEARCH),
+    'detail': _make_limiter('elastic', 'detail', config.ELASTIC_TARGET_LATENCY_DETAIL),
+}
+
+
+def elastic_limiter() -> AdaptiveLimiter:
+    return elastic_limiters[route_class.get()]
@@ -25,5 +25,89 @@ REDIS_HOST = os.getenv('REDIS_HOST', ["redis://redis-node-0",
 ELASTIC_HOST = os.getenv('ELASTIC_HOST', 'elasticsearch')
 ELASTIC_PORT = int(os.getenv('ELASTIC_PORT', 9200))
 
+# Время жизни ответов в кэше браузеров и CDN (Cache-Control: max-age), в секундах
+# списки и поиск
+HTTP_CACHE_MAX_AGE_SHORT = int(os.getenv('HTTP_CACHE_MAX_AGE_SHORT', 60))
+# карточки фильмов и персон
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 300))
+# жанры меняются редко
+HTTP_CACHE_MAX_AGE_LONG = int(os.getenv('HTTP_CACHE_MAX_AGE_LONG', 3600))
+
+# Сколько секунд даётся на обработку одного запроса
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 5))
+# Обращения к elasticsearch: число попыток и множитель паузы между ними
+ELASTIC_MAX_TRIES = int(os.getenv('ELASTIC_MAX_TRIES', 3))
+ELASTIC_RETRY_FACTOR = float(os.getenv('ELASTIC_RETRY_FACTOR', 0.05))
+# Таймаут обращения к кэшу, после него считаем, что в кэше ничего нет
+CACHE_TIMEOUT = float(os.getenv('CACHE_TIMEOUT', 0.2))
+# Цепь к бэкенду размыкается после стольких ошибок подряд ...
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+# ... и остаётся разомкнутой столько секунд
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv('BREAKER_RECOVERY_TIMEOUT', 10))
+# Ограничение одновременных обращений к elasticsearch на один воркер.
+# Лимит подстраивается сам (AIMD): растёт, пока ответы быстрее целевого
+# времени, и уменьшается вдвое, когда elastic начинает тормозить
+ADMISSION_INITIAL_LIMIT = float(os.getenv('ADMISSION_INITIAL_LIMIT', 20))
+ADMISSION_MIN_LIMIT = float(os.getenv('ADMISSION_MIN_LIMIT', 2))
+ADMISSION_MAX_LIMIT = float(os.getenv('ADMISSION_MAX_LIMIT', 200))
+# очередь сверх лимита: длина и сколько секунд в ней можно ждать
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 50))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.5))
+ADMISSION_RETRY_AFTER = float(os.getenv('ADMISSION_RETRY_AFTER', 1))
+# целевое время ответа elastic для поиска/списков и для объекта по id;
+# в замер попадает и ожидание event loop, поэтому с запасом
+ELASTIC_TARGET_LATENCY_SEARCH = float(os.getenv('ELASTIC_TARGET_LATENCY_SEARCH', 0.5))
+ELASTIC_TARGET_LATENCY_DETAIL = float(os.getenv('ELASTIC_TARGET_LATENCY_DETAIL', 0.2))
+
+# Время жизни ответов в redis зависит от популярности ключа (core.popularity):
+# обычные ключи
+CACHE_TTL = int(os.getenv('CACHE_TTL', 60 * 5))
+# запрошенные один раз, 0 - такие ответы не кэшировать
+CACHE_TTL_COLD = int(os.getenv('CACHE_TTL_COLD', 60))
+# горячие, их обновляем заранее раз в CACHE_REFRESH_AFTER секунд
+CACHE_TTL_HOT = int(os.getenv('CACHE_TTL_HOT', 60 * 30))
+CACHE_REFRESH_AFTER = int(os.getenv('CACHE_REFRESH_AFTER', 60 * 5))
+CACHE_REFRESH_CHECK_INTERVAL = float(os.getenv('CACHE_REFRESH_CHECK_INTERVAL', 10))
+# с какого числа недавних обращений ключ обычный и горячий
+CACHE_WARM_HITS = int(os.getenv('CACHE_WARM_HITS', 2))
+CACHE_HOT_HITS = int(os.getenv('CACHE_HOT_HITS', 20))
+# размер count-min sketch: CACHE_SKETCH_DEPTH строк по CACHE_SKETCH_WIDTH счётчиков
+CACHE_SKETCH_WIDTH = int(os.getenv('CACHE_SKETCH_WIDTH', 16384))
+CACHE_SKETCH_DEPTH = int(os.getenv('CACHE_SKETCH_DEPTH', 4))
+
+# Ответы меньше этого размера (в байтах) не сжимаются
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+# Журнал медленных запросов к elasticsearch: тело запроса пишется в лог,
+# если он выполнялся дольше SLOWLOG_THRESHOLD секунд
+SLOWLOG_THRESHOLD = float(os.getenv('SLOWLOG_THRESHOLD', 1))
+# по скольким последним запросам каждого отпечатка считаются перцентили
+SLOWLOG_WINDOW = int(os.getenv('SLOWLOG_WINDOW', 1000))
+SLOWLOG_MAX_FINGERPRINTS = int(os.getenv('SLOWLOG_MAX_FINGERPRINTS', 500))
+
+# Токен служебных маршрутов /admin/* (заголовок X-Admin-Token),
+# пустой - маршруты выключены
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Трассировка OpenTelemetry: otlp, file или none
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://otel-collector:4318/v1/traces')
+# файл для экспортёра file, спан на строку
+TRACING_FILE = os.getenv('TRACING_FILE', '/tmp/traces.jsonl')
+# доля записываемых трасс, при нашем числе запросов хватает одной из ста
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', 0.01))
+
+# Снимок горячих объектов в LMDB на диске узла, общий для всех воркеров.
+# Пустой SNAPSHOT_PATH выключает снимок
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', '/tmp/movies-snapshot')
+SNAPSHOT_MAP_SIZE = int(os.getenv('SNAPSHOT_MAP_SIZE', 1024 ** 3))
+# сколько самых популярных объектов каждого индекса держать в снимке
+SNAPSHOT_SIZE = int(os.getenv('SNAPSHOT_SIZE', 5000))
+# как часто применять изменения из ETL и пересобирать снимок целиком (в секундах)
+SNAPSHOT_SYNC_INTERVAL = float(os.getenv('SNAPSHOT_SYNC_INTERVAL', 5))
+SNAPSHOT_REBUILD_INTERVAL = float(os.getenv('SNAPSHOT_REBUILD_INTERVAL', 60 * 5))
+# объект горячий, если к нему обращались за последние SNAPSHOT_HOT_WINDOW секунд
+SNAPSHOT_HOT_WINDOW = int(os.getenv('SNAPSHOT_HOT_WINDOW', 60 * 60))
+
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -1,3 +1,8 @@
+import os
+
+# Уровень логов, в продакшене INFO или WARNING
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_DEFAULT_HANDLERS = ['console', ]
 
@@ -38,19 +43,19 @@ LOGGING = {
     'loggers': {
         '': {
             'handlers': LOG_DEFAULT_HANDLERS,
-            'level': 'INFO',
+            'level': LOG_LEVEL,
         },
         'uvicorn.error': {
-            'level': 'INFO',
+            'level': LOG_LEVEL,
         },
         'uvicorn.access': {
             'handlers': ['access'],
-            'level': 'INFO',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },
     'root': {
-        'level': 'INFO',
+        'level': LOG_LEVEL,
         'formatter': 'verbose',
         'handlers': LOG_DEFAULT_HANDLERS,
     },
@@ -0,0 +1,209 @@
+import os
+import time
+
+from elasticsearch import AsyncTransport
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.slowlog import slow_queries
+
+tracer = trace.get_tracer(__name__)
+
+# Метрики prometheus, отдаются на /metrics
+REQUEST_SECONDS = Histogram(
+    'api_request_seconds',
+    'Время обработки запроса к API',
+    ['method', 'route', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'api_requests_in_flight',
+    'Запросы, которые обрабатываются прямо сейчас',
+    ['method', 'route'],
+    multiprocess_mode='livesum'
+)
+CACHE_REQUESTS = Counter(
+    'api_cache_requests_total',
+    'Обращения к кэшу: hit - ответ из кэша, miss - пошли в elastic, '
+    'negative - в elastic тоже ничего не нашлось, snapshot - ответ из локального снимка',
+    ['service', 'result']
+)
+CACHE_WRITES = Counter(
+    'api_cache_writes_total',
+    'Записи в кэш по популярности ключа: cold, warm, hot, skip - не записан',
+    ['service', 'tier']
+)
+CACHE_REFRESHES = Counter(
+    'api_cache_refreshes_total',
+    'Фоновые обновления горячих ключей до истечения',
+    ['service', 'result']
+)
+LEADERBOARD_REQUESTS = Counter(
+    'api_leaderboard_requests_total',
+    'Списки фильмов по рейтингу: served - порядок из redis, fallback - поиск в elastic',
+    ['result']
+)
+SNAPSHOT_DOCS = Gauge(
+    'api_snapshot_docs',
+    'Документов в локальном снимке горячих объектов',
+    ['index'],
+    multiprocess_mode='max'
+)
+SNAPSHOT_WRITES = Counter(
+    'api_snapshot_writes_total',
+    'Документы, записанные в локальный снимок: rebuild - полная пересборка, '
+    'sync - изменения из ETL',
+    ['index', 'kind']
+)
+REDIS_SECONDS = Histogram(
+    'api_redis_seconds',
+    'Время выполнения команды redis',
+    ['command'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf'))
+)
+SERIALIZE_SECONDS = Histogram(
+    'api_serialize_seconds',
+    'Проверка моделью и сериализация ответа перед записью в кэш',
+    ['model'],
+    buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, float('inf'))
+)
+ELASTIC_SECONDS = Histogram(
+    'api_elastic_request_seconds',
+    'Время запроса к elasticsearch со стороны клиента',
+    ['index', 'operation']
+)
+ELASTIC_TOOK_SECONDS = Histogram(
+    'api_elastic_took_seconds',
+    'Время выполнения запроса внутри elasticsearch (поле took)',
+    ['index', 'operation']
+)
+RETRIES = Counter(
+    'api_backoff_retries_total',
+    'Повторные попытки после ошибки',
+    ['target']
+)
+CIRCUIT_OPEN = Gauge(
+    'api_circuit_open',
+    'Цепь к бэкенду разомкнута (1) или замкнута (0)',
+    ['backend'],
+    multiprocess_mode='max'
+)
+ADMISSION_LIMIT = Gauge(
+    'api_admission_limit',
+    'Текущий лимит одновременных обращений к бэкенду (AIMD)',
+    ['backend', 'route_class'],
+    multiprocess_mode='livesum'
+)
+ADMISSION_REJECTED = Counter(
+    'api_admission_rejected_total',
+    'Запросы, не пропущенные к бэкенду из-за перегрузки',
+    ['backend', 'route_class', 'reason']
+)
+
+
+def render_metrics() -> bytes:
+    """
+    Метрики в формате prometheus. Под gunicorn у каждого воркера свои
+    счётчики, тогда они собираются из файлов PROMETHEUS_MULTIPROC_DIR.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def count_retry(details: dict) -> None:
+    """Обработчик on_backoff для backoff.on_exception"""
+    RETRIES.labels(details['target'].__qualname__).inc()
+
+
+def route_name(scope: Scope) -> str:
+    """
+    Шаблон пути вместо самого пути, чтобы id фильмов и персон
+    не плодили отдельные серии метрик.
+    """
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', 'unknown')
+    return 'unmatched'
+
+
+class MetricsMiddleware:
+    """Время ответа и число запросов в обработке по каждому маршруту"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        route = route_name(scope)
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.labels(method, route, status).observe(time.perf_counter() - started)
+            in_flight.dec()
+
+
+class InstrumentedTransport(AsyncTransport):
+    """Транспорт AsyncElasticsearch, который замеряет каждый запрос"""
+
+    @staticmethod
+    def _describe(method: str, url: str):
+        parts = [part for part in url.split('/') if part]
+        if not parts:
+            return '', method.lower()
+        if parts[0].startswith('_'):
+            return '', parts[0]
+        if len(parts) > 1 and parts[1].startswith('_'):
+            operation = parts[1]
+            if operation == '_doc':
+                operation = method.lower()
+            return parts[0], operation
+        return parts[0], method.lower()
+
+    async def perform_request(self, method, url, headers=None, params=None, body=None):
+        index, operation = self._describe(method, url)
+        with tracer.start_as_current_span(f'elastic {operation}', kind=SpanKind.CLIENT,
+                                          attributes={'db.system': 'elasticsearch',
+                                                      'db.operation': operation,
+                                                      'elastic.index': index}) as span:
+            started = time.perf_counter()
+            try:
+                result = await super().perform_request(
+                    method, url, headers=headers, params=params, body=body)
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                ELASTIC_SECONDS.labels(index, operation).observe(elapsed)
+                # 404 - обычный ответ для объекта по id, а не ошибка запроса
+                slow_queries.record(index, operation, body, elapsed,
+                                    error=getattr(e, 'status_code', None) != 404)
+                raise
+            elapsed = time.perf_counter() - started
+            ELASTIC_SECONDS.labels(index, operation).observe(elapsed)
+            took = None
+            if isinstance(result, dict) and 'took' in result:
+                took = result['took']
+                ELASTIC_TOOK_SECONDS.labels(index, operation).observe(took / 1000)
+                span.set_attribute('elastic.took_ms', took)
+            slow_queries.record(index, operation, body, elapsed, took)
+            return result
@@ -0,0 +1,121 @@
+import time
+from array import array
+from typing import Dict
+
+from core import config
+
+
+class CountMinSketch:
+    """
+    Приблизительный счётчик обращений к ключам в фиксированном объёме памяти
+    (depth * width счётчиков по 2 байта). Оценка может быть завышена
+    из-за коллизий, но не занижена. После sample_size обращений все
+    счётчики делятся пополам, поэтому учитывается недавняя популярность.
+    """
+
+    MAX_COUNT = 0xFFFF
+
+    def __init__(self, width: int, depth: int, sample_size: int):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size
+        self.rows = [array('H', bytes(2 * width)) for _ in range(depth)]
+        self.additions = 0
+
+    def _indexes(self, key: str):
+        # двойное хэширование: depth независимых позиций из одного hash()
+        first = hash(key)
+        second = (first >> 16) | 1
+        return [(first + i * second) % self.width for i in range(self.depth)]
+
+    def add(self, key: str) -> int:
+        """Учесть обращение к ключу и вернуть новую оценку числа обращений"""
+        indexes = self._indexes(key)
+        count = min(row[i] for row, i in zip(self.rows, indexes))
+        if count < self.MAX_COUNT:
+            count += 1
+            # консервативное обновление: увеличиваем только минимальные
+            # счётчики, так меньше завышаются оценки редких ключей
+            for row, i in zip(self.rows, indexes):
+                if row[i] < count:
+                    row[i] = count
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+        return count
+
+    def estimate(self, key: str) -> int:
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def _age(self) -> None:
+        self.rows = [array('H', (value >> 1 for value in row)) for row in self.rows]
+        self.additions = 0
+
+
+class PopularityTracker:
+    """
+    Время жизни ключа в кэше по его популярности:
+    разовые запросы живут недолго или не кэшируются вовсе,
+    горячие - дольше и обновляются заранее, до истечения.
+    Счётчики у каждого воркера свои.
+    """
+
+    def __init__(self, sketch: CountMinSketch, warm_hits: int, hot_hits: int,
+                 cold_ttl: int, warm_ttl: int, hot_ttl: int,
+                 refresh_after: int, check_interval: float):
+        self.sketch = sketch
+        self.warm_hits = warm_hits
+        self.hot_hits = hot_hits
+        self.cold_ttl = cold_ttl
+        self.warm_ttl = warm_ttl
+        self.hot_ttl = hot_ttl
+        self.refresh_after = refresh_after
+        self.check_interval = check_interval
+        self._checked: Dict[str, float] = {}
+
+    def touch(self, key: str) -> int:
+        return self.sketch.add(key)
+
+    def tier(self, hits: int) -> str:
+        if hits >= self.hot_hits:
+            return 'hot'
+        if hits >= self.warm_hits:
+            return 'warm'
+        return 'cold'
+
+    def ttl(self, tier: str) -> int:
+        """Время жизни в секундах, 0 - не кэшировать"""
+        return {'hot': self.hot_ttl, 'warm': self.warm_ttl, 'cold': self.cold_ttl}[tier]
+
+    def is_stale(self, ttl_left: int) -> bool:
+        """
+        Горячий ключ пора обновить: он записан дольше refresh_after
+        секунд назад или был записан ещё не как горячий
+        """
+        return 0 <= ttl_left <= self.hot_ttl - self.refresh_after
+
+    def refresh_due(self, key: str) -> bool:
+        """
+        Проверять ли свежесть горячего ключа сейчас: не чаще раза
+        в check_interval секунд на ключ, чтобы не удваивать запросы к redis
+        """
+        now = time.monotonic()
+        if now - self._checked.get(key, 0) < self.check_interval:
+            return False
+        if len(self._checked) > 10000:
+            self._checked.clear()
+        self._checked[key] = now
+        return True
+
+
+popularity = PopularityTracker(
+    CountMinSketch(config.CACHE_SKETCH_WIDTH, config.CACHE_SKETCH_DEPTH,
+                   sample_size=config.CACHE_SKETCH_WIDTH * 10),
+    warm_hits=config.CACHE_WARM_HITS,
+    hot_hits=config.CACHE_HOT_HITS,
+    cold_ttl=config.CACHE_TTL_COLD,
+    warm_ttl=config.CACHE_TTL,
+    hot_ttl=config.CACHE_TTL_HOT,
+    refresh_after=config.CACHE_REFRESH_AFTER,
+    check_interval=config.CACHE_REFRESH_CHECK_INTERVAL,
+)
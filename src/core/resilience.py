@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Optional
+
+import backoff
+from elasticsearch import exceptions as es_exceptions
+from opentelemetry import trace
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core import config
+from core.admission import elastic_limiter, route_class
+from core.metrics import CIRCUIT_OPEN, count_retry
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# момент (time.monotonic), к которому запрос должен получить ответ
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Время на обработку запроса истекло"""
+
+
+class BackendUnavailable(Exception):
+    """Бэкенд недоступен: цепь разомкнута или повторы исчерпаны"""
+
+    def __init__(self, backend: str, retry_after: float = 0):
+        super().__init__(f'{backend} is unavailable')
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна запроса, None - дедлайна нет"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(limit: Optional[float] = None) -> Optional[float]:
+    """Таймаут одного обращения: не больше limit и не дольше дедлайна запроса"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+    if left is None:
+        return limit
+    return left if limit is None else min(limit, left)
+
+
+class DeadlineMiddleware:
+    """Задаёт дедлайн каждому http-запросу, сервисы читают его через remaining()"""
+
+    def __init__(self, app: ASGIApp, timeout: float) -> None:
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        token = request_deadline.set(time.monotonic() + self.timeout)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Размыкает цепь после failure_threshold ошибок подряд: следующие
+    recovery_timeout секунд обращения к бэкенду не выполняются вовсе.
+    Потом пропускается одно пробное обращение - при успехе цепь замыкается.
+    """
+
+    def __init__(self, backend: str, failure_threshold: int, recovery_timeout: float):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False
+
+    @property
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(self.opened_at + self.recovery_timeout - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.retry_after > 0 or self._probe:
+            return False
+        # полуоткрытое состояние: пропускаем одно пробное обращение
+        self._probe = True
+        return True
+
+    def check(self) -> None:
+        if not self.allow():
+            raise BackendUnavailable(self.backend, self.retry_after or self.recovery_timeout)
+
+    @property
+    def probing(self) -> bool:
+        """Пропущенное обращение - пробное: цепь разомкнута, а allow() его пропустил"""
+        return self.opened_at is not None
+
+    def release_probe(self) -> None:
+        """
+        Пробное обращение отменено, не дождавшись ответа: о бэкенде
+        ничего не известно, следующее обращение снова будет пробным
+        """
+        self._probe = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f'Circuit for {self.backend} closed')
+        self.failures = 0
+        self.opened_at = None
+        self._probe = False
+        CIRCUIT_OPEN.labels(self.backend).set(0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probe:
+                logger.warning(f'Circuit for {self.backend} opened after {self.failures} failures')
+            self.opened_at = time.monotonic()
+            self._probe = False
+            CIRCUIT_OPEN.labels(self.backend).set(1)
+
+
+elastic_breaker = CircuitBreaker('elastic', config.BREAKER_FAILURE_THRESHOLD,
+                                 config.BREAKER_RECOVERY_TIMEOUT)
+redis_breaker = CircuitBreaker('redis', config.BREAKER_FAILURE_THRESHOLD,
+                               config.BREAKER_RECOVERY_TIMEOUT)
+
+
+def is_retryable_elastic(error: Exception) -> bool:
+    """
+    Повторять имеет смысл только сетевые ошибки и перегрузку.
+    404 и ошибки в запросе повтором не исправить.
+    """
+    if isinstance(error, (es_exceptions.ConnectionError, asyncio.TimeoutError)):
+        return True
+    return (isinstance(error, es_exceptions.TransportError)
+            and error.status_code in (429, 502, 503, 504))
+
+
+def elastic_call(func: Callable) -> Callable:
+    """
+    Обращение к elasticsearch: каждый вызов ограничен дедлайном запроса,
+    ошибки из is_retryable_elastic повторяются не больше ELASTIC_MAX_TRIES раз,
+    пока не истёк дедлайн. Если цепь разомкнута, вызов не выполняется.
+    """
+
+    @backoff.on_exception(backoff.expo,
+                          (es_exceptions.TransportError, asyncio.TimeoutError),
+                          max_tries=config.ELASTIC_MAX_TRIES,
+                          max_time=lambda: remaining(),
+                          giveup=lambda e: not is_retryable_elastic(e),
+                          factor=config.ELASTIC_RETRY_FACTOR,
+                          on_backoff=count_retry)
+    @wraps(func)
+    async def attempt(*args, **kwargs):
+        limiter = elastic_limiter()
+        # сверх лимита запрос ждёт в очереди или сразу получает отказ (Overloaded)
+        await limiter.acquire(call_timeout())
+        started = time.monotonic()
+        # None - до elastic дело не дошло или вызов отменён,
+        # лимит и цепь по такому вызову не меняем
+        healthy = None
+        probe = False
+        try:
+            # дедлайн истёк - обращения не было, цепь об этом не узнаёт
+            timeout = call_timeout()
+            elastic_breaker.check()
+            probe = elastic_breaker.probing
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except Exception as e:
+                # на ошибку в самом запросе elastic ответил, значит он жив
+                healthy = not is_retryable_elastic(e)
+                raise
+            healthy = True
+            return result
+        finally:
+            if healthy is None:
+                limiter.release(0, ok=True, adjust=False)
+                if probe:
+                    # иначе цепь так и останется разомкнутой в ожидании пробы
+                    elastic_breaker.release_probe()
+            else:
+                limiter.release(time.monotonic() - started, ok=healthy)
+                if healthy:
+                    elastic_breaker.record_success()
+                else:
+                    elastic_breaker.record_failure()
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        # в спане вызова по дочернему спану на каждую попытку (InstrumentedTransport)
+        with tracer.start_as_current_span(func.__qualname__,
+                                          attributes={'route_class': route_class.get()}):
+            try:
+                return await attempt(*args, **kwargs)
+            except asyncio.TimeoutError:
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded()
+                raise BackendUnavailable('elastic', config.BREAKER_RECOVERY_TIMEOUT)
+            except es_exceptions.TransportError as e:
+                if is_retryable_elastic(e):
+                    raise BackendUnavailable('elastic', config.BREAKER_RECOVERY_TIMEOUT) from e
+                raise
+
+    return wrapper
+
+
+def cache_call(default=None) -> Callable:
+    """
+    Обращение к redis без повторов и с коротким таймаутом.
+    Кэш не должен задерживать ответ: при ошибке, таймауте
+    или разомкнутой цепи возвращается default (промах кэша).
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                timeout = call_timeout(config.CACHE_TIMEOUT)
+            except DeadlineExceeded:
+                return default
+            if not redis_breaker.allow():
+                return default
+            probe = redis_breaker.probing
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except Exception as e:
+                redis_breaker.record_failure()
+                logger.warning(f'Cache {func.__name__} failed: {e!r}')
+                return default
+            except BaseException:
+                # отмена (CancelledError) ничего не говорит о redis,
+                # но пробу надо отпустить, иначе цепь не замкнётся никогда
+                if probe:
+                    redis_breaker.release_probe()
+                raise
+            redis_breaker.record_success()
+            return result
+
+        return wrapper
+
+    return decorator
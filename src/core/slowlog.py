@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import orjson
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+
+def query_shape(value: Any) -> Any:
+    """
+    Структура запроса без литералов: строки и числа заменяются на '?',
+    одинаковые элементы списка схлопываются, поэтому запросы,
+    которые отличаются только текстом поиска, id или числом id, совпадают.
+    """
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return '?'
+
+
+def fingerprint(index: str, operation: str, shape: Any) -> str:
+    data = f'{index}/{operation}'.encode() + orjson.dumps(shape, option=orjson.OPT_SORT_KEYS)
+    return hashlib.md5(data).hexdigest()[:12]
+
+
+class QueryStats:
+    """Счётчики одного отпечатка, перцентили считаются по последним window замерам"""
+
+    def __init__(self, index: str, operation: str, shape: Any, window: int):
+        self.index = index
+        self.operation = operation
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.slow = 0
+        self.total_seconds = 0.0
+        self.max_took_ms = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    @staticmethod
+    def percentile(ordered: List[float], q: float) -> float:
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def as_dict(self) -> dict:
+        ordered = sorted(self.latencies)
+        result = {
+            'index': self.index,
+            'operation': self.operation,
+            'count': self.count,
+            'errors': self.errors,
+            'slow': self.slow,
+            'total_seconds': round(self.total_seconds, 3),
+            'max_took_ms': self.max_took_ms,
+            'shape': self.shape,
+        }
+        if ordered:
+            result.update({f'p{int(q * 100)}_ms': round(self.percentile(ordered, q) * 1000, 1)
+                           for q in (.5, .95, .99)})
+        return result
+
+
+class SlowQueryRecorder:
+    """
+    Журнал запросов к elasticsearch по отпечаткам (структура без литералов).
+    Полное тело запроса пишется в лог только дольше threshold секунд.
+    Статистика у каждого воркера своя.
+    """
+
+    def __init__(self, threshold: float, window: int, max_fingerprints: int):
+        self.threshold = threshold
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self.stats: Dict[str, QueryStats] = {}
+        self.started_at = time.time()
+
+    def record(self, index: str, operation: str, body: Any, seconds: float,
+               took_ms: Optional[int] = None, error: bool = False) -> None:
+        if isinstance(body, (bytes, str)):
+            # тело, уже сериализованное клиентом (mget, bulk)
+            try:
+                body = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                body = None
+        shape = query_shape(body or {})
+        key = fingerprint(index, operation, shape)
+        stats = self.stats.get(key)
+        if stats is None:
+            if len(self.stats) >= self.max_fingerprints:
+                # отпечатков не бывает много, если их много - запросы
+                # собираются с литералами в структуре, копить их не будем
+                return
+            stats = self.stats[key] = QueryStats(index, operation, shape, self.window)
+        stats.count += 1
+        stats.errors += error
+        stats.total_seconds += seconds
+        stats.latencies.append(seconds)
+        if took_ms is not None:
+            stats.max_took_ms = max(stats.max_took_ms, took_ms)
+        if seconds >= self.threshold:
+            stats.slow += 1
+            logger.warning(f'Slow elastic query {key} on {index or "-"}/{operation}: '
+                           f'{seconds:.3f}s, took {took_ms} ms, body '
+                           f'{orjson.dumps(body).decode() if body else "-"}')
+
+    def snapshot(self) -> dict:
+        """Отпечатки по убыванию суммарного времени - сверху то, что стоит оптимизировать"""
+        queries = [{'fingerprint': key, **stats.as_dict()} for key, stats in self.stats.items()]
+        queries.sort(key=lambda item: item['total_seconds'], reverse=True)
+        return {
+            'since': self.started_at,
+            'threshold_seconds': self.threshold,
+            'queries': queries,
+        }
+
+    def reset(self) -> None:
+        self.stats.clear()
+        self.started_at = time.time()
+
+
+slow_queries = SlowQueryRecorder(config.SLOWLOG_THRESHOLD, config.SLOWLOG_WINDOW,
+                                 config.SLOWLOG_MAX_FINGERPRINTS)
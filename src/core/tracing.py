@@ -0,0 +1,104 @@
+import logging
+import os
+from typing import Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
+                                            ConsoleSpanExporter, SpanExporter)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, StatusCode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core import config
+from core.metrics import route_name
+
+logger = logging.getLogger(__name__)
+
+# Пока setup_tracing не вызван, спаны ничего не записывают
+tracer = trace.get_tracer(__name__)
+
+
+def make_exporter(kind: str) -> Optional[SpanExporter]:
+    """
+    otlp - отправка в коллектор по OTLP/HTTP,
+    file - спаны построчно в json-файл (для отладки и тестов),
+    none - трассировка выключена.
+    """
+    if kind == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+            OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=config.TRACING_OTLP_ENDPOINT)
+    if kind == 'file':
+        return ConsoleSpanExporter(
+            out=open(config.TRACING_FILE, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    if kind != 'none':
+        logger.warning(f'Unknown tracing exporter {kind!r}, tracing disabled')
+    return None
+
+
+def setup_tracing(service_name: str) -> Optional[TracerProvider]:
+    """
+    Включить трассировку в текущем процессе. Вызывается из startup,
+    под gunicorn - в каждом воркере после fork, потому что
+    BatchSpanProcessor отправляет спаны из своего потока.
+    """
+    exporter = make_exporter(config.TRACING_EXPORTER)
+    if exporter is None:
+        return None
+    # решение о записи принимается один раз для всей трассы:
+    # если вызывающий прислал traceparent, следуем его выбору
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name}),
+        sampler=ParentBased(TraceIdRatioBased(config.TRACING_SAMPLE_RATIO)))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f'Tracing enabled: {config.TRACING_EXPORTER}, '
+                f'sample ratio {config.TRACING_SAMPLE_RATIO}')
+    return provider
+
+
+def shutdown_tracing() -> None:
+    """Отправить накопленные спаны перед остановкой процесса"""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+class TracingMiddleware:
+    """Корневой спан на каждый http-запрос, продолжает трассу из traceparent"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode('latin-1'): value.decode('latin-1')
+                   for key, value in scope['headers']}
+        method = scope['method']
+        with tracer.start_as_current_span(method, context=propagate.extract(headers),
+                                          kind=SpanKind.SERVER) as span:
+            if not span.is_recording():
+                # запрос не попал в выборку, не тратим время на атрибуты
+                await self.app(scope, receive, send)
+                return
+
+            route = route_name(scope)
+            span.update_name(f'{method} {route}')
+            span.set_attribute('http.method', method)
+            span.set_attribute('http.route', route)
+            span.set_attribute('http.target', scope['path'])
+
+            async def send_with_status(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    span.set_attribute('http.status_code', message['status'])
+                    if message['status'] >= 500:
+                        span.set_status(StatusCode.ERROR)
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
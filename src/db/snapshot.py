@@ -0,0 +1,72 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+import lmdb
+
+# id горячих объектов от всех воркеров, score - время последнего обращения
+HOT_KEY = 'snapshot:hot:{index}'
+# id изменённых ETL документов, score - время изменения (SnapshotChangeFeed в etl)
+CHANGES_KEY = 'snapshot:changes:{index}'
+
+
+class SnapshotStore:
+    """
+    Снимок горячих документов в LMDB на локальном диске узла.
+    Файл отображается в память, страницы общие для всех воркеров
+    через page cache, поэтому копия на узле одна, а не на каждый воркер.
+    Пишет один воркер (services.snapshot.SnapshotRefresher), читают все.
+    Значения - готовые тела ответов API по id объекта.
+    """
+
+    def __init__(self, path: str, map_size: int, indices: Iterable[str]):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        indices = list(indices)
+        # снимок всегда можно построить заново, поэтому без fsync на каждую запись
+        self.env = lmdb.open(path, map_size=map_size, max_dbs=len(indices),
+                             sync=False, readahead=False)
+        self.dbs = {index: self.env.open_db(index.encode()) for index in indices}
+        self.max_key_size = self.env.max_key_size()
+
+    def get(self, index: str, doc_id: str) -> Optional[bytes]:
+        key = doc_id.encode()
+        if len(key) > self.max_key_size:
+            return None
+        # buffers=True - поиск по страницам mmap без копирования,
+        # копируется только найденное тело ответа
+        with self.env.begin(db=self.dbs[index], buffers=True) as txn:
+            data = txn.get(key)
+            return bytes(data) if data is not None else None
+
+    def contains(self, index: str, doc_id: str) -> bool:
+        with self.env.begin(db=self.dbs[index], buffers=True) as txn:
+            return txn.get(doc_id.encode()) is not None
+
+    def count(self, index: str) -> int:
+        with self.env.begin() as txn:
+            return txn.stat(self.dbs[index])['entries']
+
+    def ids(self, index: str) -> List[str]:
+        with self.env.begin(db=self.dbs[index]) as txn:
+            return [key.decode() for key in txn.cursor().iternext(values=False)]
+
+    def update(self, index: str, bodies: Dict[str, bytes]) -> None:
+        with self.env.begin(db=self.dbs[index], write=True) as txn:
+            for doc_id, body in bodies.items():
+                txn.put(doc_id.encode(), body)
+
+    def replace(self, index: str, bodies: Dict[str, bytes]) -> None:
+        """Заменить содержимое индекса целиком, читатели видят смену атомарно"""
+        with self.env.begin(db=self.dbs[index], write=True) as txn:
+            stale = [key for key in txn.cursor().iternext(values=False)
+                     if key.decode() not in bodies]
+            for key in stale:
+                txn.delete(key)
+            for doc_id, body in bodies.items():
+                txn.put(doc_id.encode(), body)
+
+    def close(self) -> None:
+        self.env.close()
+
+
+snapshot: SnapshotStore = None
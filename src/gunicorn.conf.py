@@ -0,0 +1,45 @@
+# Настройки gunicorn для запуска API в продакшене:
+#
+#   $ gunicorn main:app -c gunicorn.conf.py
+#
+# Каждый воркер - отдельный процесс с uvicorn (uvloop + httptools)
+# и своими подключениями к redis и elasticsearch, они создаются
+# в startup уже после fork.
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+
+# асинхронному воркеру достаточно одного процесса на ядро
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# воркер, не отвечающий мастеру дольше timeout, перезапускается
+timeout = int(os.getenv('WORKER_TIMEOUT', 60))
+# после SIGTERM воркеры дорабатывают начатые запросы не дольше graceful_timeout
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+# подключения к бэкендам не должны переживать fork
+preload_app = False
+
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+errorlog = '-'
+# access-лог на каждый запрос дорог под нагрузкой, включается явно
+accesslog = '-' if os.getenv('ACCESS_LOG') == '1' else None
+
+
+def on_starting(server):
+    # в режиме нескольких процессов метрики воркеров лежат в файлах,
+    # от прошлого запуска их нужно убрать
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path and os.path.isdir(path):
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    # метрики завершившегося воркера больше не собираем
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
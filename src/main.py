@@ -1,16 +1,27 @@
-import logging
+import asyncio
+from http import HTTPStatus
 
 import aioredis_cluster
 import uvicorn as uvicorn
 from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import ORJSONResponse
 from fastapi_pagination import add_pagination
+from prometheus_client import CONTENT_TYPE_LATEST
 
+from api import admin
 from api.v1 import film, genre, person
 from core import config
-from core.logger import LOGGING
-from db import elastic, redis
+from core.admission import AdmissionMiddleware, Overloaded
+from core.compression import CompressionMiddleware
+from core.logger import LOG_LEVEL, LOGGING
+from core.metrics import (InstrumentedTransport, MetricsMiddleware,
+                          render_metrics)
+from core.resilience import (BackendUnavailable, DeadlineExceeded,
+                             DeadlineMiddleware)
+from core.tracing import TracingMiddleware, setup_tracing, shutdown_tracing
+from db import elastic, redis, snapshot
+from services.snapshot import SNAPSHOT_MODELS, SnapshotRefresher
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -21,6 +32,17 @@ app = FastAPI(
     version='1.0.0'
 )
 
+# класс маршрута (поиск или объект по id) для лимитов обращений к elastic
+app.add_middleware(AdmissionMiddleware)
+# у каждого запроса есть дедлайн, дольше него ответа бэкендов не ждём
+app.add_middleware(DeadlineMiddleware, timeout=config.REQUEST_TIMEOUT)
+# сжимаем ответы, которые не были сжаты заранее (документация, ошибки)
+app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE)
+# корневой спан запроса, внутри него спаны кэша и elastic
+app.add_middleware(TracingMiddleware)
+# метрики добавляем последними, чтобы в замер попадало и сжатие
+app.add_middleware(MetricsMiddleware)
+
 # добавляем пагинацию нашему api
 add_pagination(app)
 
@@ -30,17 +52,70 @@ async def startup():
     # Подключаемся к базам при старте сервера
     # Подключиться можем при работающем event-loop
     # Поэтому логика подключения происходит в асинхронной функции
+    # Под gunicorn startup выполняется в каждом воркере после fork,
+    # так что у каждого воркера свои подключения и свой экспортёр спанов
+    setup_tracing(f'{config.PROJECT_NAME}-api')
     redis.redis = await aioredis_cluster.create_redis_cluster(config.REDIS_HOST)
 
     elastic.es = AsyncElasticsearch(
-        hosts=[f'{config.ELASTIC_HOST}:{config.ELASTIC_PORT}'])
+        hosts=[f'{config.ELASTIC_HOST}:{config.ELASTIC_PORT}'],
+        transport_class=InstrumentedTransport,
+        # повторы и таймауты задаются в core.resilience
+        max_retries=0)
+
+    if config.SNAPSHOT_PATH:
+        # снимок горячих объектов открывают все воркеры узла,
+        # обновляет его один из них (SnapshotRefresher)
+        snapshot.snapshot = snapshot.SnapshotStore(
+            config.SNAPSHOT_PATH, config.SNAPSHOT_MAP_SIZE, SNAPSHOT_MODELS)
+        refresher = SnapshotRefresher(snapshot.snapshot, redis.redis, elastic.es)
+        app.state.snapshot_task = asyncio.create_task(refresher.run())
 
 
 @app.on_event('shutdown')
 async def shutdown():
-    # Отключаемся от баз при выключении сервера
-    await redis.redis.close()
-    await elastic.es.close()
+    # Отключаемся от баз при выключении сервера,
+    # к этому моменту uvicorn уже дождался завершения начатых запросов
+    task = getattr(app.state, 'snapshot_task', None)
+    if task is not None:
+        task.cancel()
+    if snapshot.snapshot is not None:
+        snapshot.snapshot.close()
+        snapshot.snapshot = None
+    if redis.redis is not None:
+        redis.redis.close()
+        await redis.redis.wait_closed()
+    if elastic.es is not None:
+        await elastic.es.close()
+    shutdown_tracing()
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return ORJSONResponse(status_code=HTTPStatus.GATEWAY_TIMEOUT,
+                          content={'detail': 'request deadline exceeded'})
+
+
+@app.exception_handler(BackendUnavailable)
+async def backend_unavailable_handler(request: Request, exc: BackendUnavailable):
+    return ORJSONResponse(status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                          content={'detail': f'{exc.backend} is unavailable'},
+                          headers={'Retry-After': str(max(int(exc.retry_after), 1))})
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # быстрый отказ вместо очереди к перегруженному elastic;
+    # ответы из кэша при этом продолжают отдаваться
+    return ORJSONResponse(status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                          content={'detail': f'{exc.backend} is overloaded'},
+                          headers={'Retry-After': str(max(int(exc.retry_after), 1))})
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    # метрики для prometheus
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
 
 
 # Подключаем роутер к серверу, указав префикс /v1/film
@@ -48,6 +123,8 @@ async def shutdown():
 app.include_router(film.router, prefix='/api/v1/film', tags=['Фильмы'])
 app.include_router(genre.router, prefix='/api/v1/genre', tags=['Жанры'])
 app.include_router(person.router, prefix='/api/v1/person', tags=['Люди'])
+# служебные маршруты, только с токеном ADMIN_TOKEN
+app.include_router(admin.router, prefix='/admin', include_in_schema=False)
 
 if __name__ == '__main__':
     uvicorn.run(
@@ -55,5 +132,5 @@ if __name__ == '__main__':
         host='0.0.0.0',
         port=8000,
         log_config=LOGGING,
-        log_level=logging.DEBUG,
+        log_level=LOG_LEVEL.lower(),
     )
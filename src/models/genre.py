@@ -16,3 +16,12 @@ class Genre(BaseModel):
     class Config:
         json_loads = orjson.loads
         json_dumps = orjson_dumps
+
+
+class GenreShort(BaseModel):
+    id: UUID4
+    name: str
+
+    class Config:
+        json_loads = orjson.loads
+        json_dumps = orjson_dumps
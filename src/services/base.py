@@ -1,12 +1,46 @@
 
 import abc
-import json
-from typing import Any, Optional
-import backoff
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Type
+
+import orjson
+from db import snapshot
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from pydantic import BaseModel
+
+from core import config
+from core.compression import compress
+from core.metrics import (CACHE_REFRESHES, CACHE_REQUESTS, CACHE_WRITES,
+                          REDIS_SECONDS, SERIALIZE_SECONDS)
+from core.popularity import popularity
+from core.resilience import cache_call, request_deadline
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# фоновые задачи (обновления кэша, отметки для снимка),
+# ссылки держим, чтобы задачи не собрал gc
+_background_tasks: Set[asyncio.Task] = set()
+# когда воркер последний раз сообщил о горячем объекте для снимка
+_hot_reported: Dict[str, float] = {}
+# о горячем объекте сообщаем не чаще раза в HOT_REPORT_INTERVAL секунд
+HOT_REPORT_INTERVAL = 60
+
+
+def _run_in_background(coro: Awaitable[Any]) -> None:
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 
 class BaseService:
-    FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+    # имя сервиса в метриках
+    name = 'base'
+    # индекс elastic с объектами сервиса, он же раздел локального снимка
+    index = None
 
     @abc.abstractmethod
     async def get_by_id(self, *args, **kwargs) -> Any:
@@ -33,21 +67,182 @@ class BaseService:
         """Получить объекты по параметрам"""
         pass
 
-    @backoff.on_exception(backoff.expo, Exception)
+    async def _get_detail(self,
+                          url: str,
+                          doc_id: str,
+                          model: Type[BaseModel],
+                          fetch: Callable[[], Awaitable[Any]]
+                          ) -> Optional[bytes]:
+        """
+        Объект по id. Горячие объекты есть в локальном снимке (db.snapshot):
+        он быстрее redis и отвечает, даже когда elastic недоступен.
+        Остальные - через кэш, как и прочие ответы.
+        """
+        key = str(url)
+        hits = popularity.touch(key)
+        store = snapshot.snapshot
+        if store is not None:
+            if popularity.tier(hits) == 'hot' and self._report_due(doc_id):
+                # ответ не ждёт redis, отметка уходит в фоне
+                _run_in_background(self._report_hot(doc_id))
+            data = store.get(self.index, doc_id)
+            if data is not None:
+                self._count_cache('snapshot')
+                return data
+        return await self._get_cached(url, model, fetch, hits)
+
+    def _report_due(self, doc_id: str) -> bool:
+        key = f'{self.index}:{doc_id}'
+        now = time.monotonic()
+        if now - _hot_reported.get(key, 0) < HOT_REPORT_INTERVAL:
+            return False
+        if len(_hot_reported) > 10000:
+            _hot_reported.clear()
+        _hot_reported[key] = now
+        return True
+
+    @cache_call()
+    async def _report_hot(self, doc_id: str) -> None:
+        """Отметить объект горячим, из этих отметок собирается снимок"""
+        with REDIS_SECONDS.labels('zadd').time():
+            await self.redis.zadd(snapshot.HOT_KEY.format(index=self.index), time.time(), doc_id)
+
+    async def _get_cached(self,
+                          url: str,
+                          model: Type[BaseModel],
+                          fetch: Callable[[], Awaitable[Any]],
+                          hits: Optional[int] = None
+                          ) -> Optional[bytes]:
+        """
+        Тело ответа из кэша, при промахе - из elastic через fetch.
+        Популярность ключа определяет, сколько ответ проживёт в кэше,
+        горячие ключи обновляются в фоне до того, как истекут.
+        hits передаётся, если обращение к ключу уже учтено.
+        """
+        key = str(url)
+        if hits is None:
+            hits = popularity.touch(key)
+        data = await self._check_cache(key)
+        if data:
+            if popularity.tier(hits) == 'hot' and popularity.refresh_due(key):
+                _run_in_background(self._refresh_cache(key, model, fetch))
+            return data
+        return await self._fill_cache(key, model, fetch, hits)
+
+    async def _fill_cache(self,
+                          key: str,
+                          model: Type[BaseModel],
+                          fetch: Callable[[], Awaitable[Any]],
+                          hits: int) -> Optional[bytes]:
+        data = await fetch()
+        if not data:
+            self._count_cache('negative')
+            return None
+        data = self._serialize(model, data)
+        await self._load_cache(key, data, popularity.tier(hits))
+        return data
+
+    async def _refresh_cache(self,
+                             key: str,
+                             model: Type[BaseModel],
+                             fetch: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Перечитать горячий ключ из elastic, если его пора обновить.
+        Из нескольких воркеров обновляет тот, кто первым взял блокировку.
+        """
+        # задача унаследовала контекст запроса, дедлайн и спан у неё свои
+        request_deadline.set(time.monotonic() + config.REQUEST_TIMEOUT)
+        with tracer.start_as_current_span('cache refresh', context=otel_context.Context(),
+                                          attributes={'service': self.name}):
+            try:
+                ttl_left = await self._redis_ttl(key)
+                if ttl_left is None or not popularity.is_stale(ttl_left):
+                    return
+                if not await self._redis_lock(f'refresh:{key}', config.REQUEST_TIMEOUT):
+                    return
+                data = await self._fill_cache(key, model, fetch, popularity.hot_hits)
+                CACHE_REFRESHES.labels(self.name, 'ok' if data else 'gone').inc()
+            except Exception as e:
+                # ключ остаётся в кэше, попробуем в следующий раз
+                CACHE_REFRESHES.labels(self.name, 'error').inc()
+                logger.warning(f'Cache refresh of {key} failed: {e!r}')
+
     async def _check_cache(self,
                            url: str,
-                           ) -> Optional[Any]:
+                           ) -> Optional[bytes]:
 
-        """Найти обьекты в кэше."""
-        result = await self.redis.get(str(url), )
-        if result:
-            result = json.loads(result)
-        return result
+        """Найти готовое тело ответа в кэше. Недоступный кэш - это промах."""
+        with tracer.start_as_current_span('cache get', attributes={'service': self.name}) as span:
+            data = await self._redis_get(str(url))
+            span.set_attribute('cache.hit', bool(data))
+        self._count_cache('hit' if data else 'miss')
+        return data
 
-    @backoff.on_exception(backoff.expo, Exception)
     async def _load_cache(self,
                           url: str,
-                          data: Any):
-        """Запись объектов в кэш."""
-        data = json.dumps(data)
-        await self.redis.set(key=str(url), value=data, expire=self.FILM_CACHE_EXPIRE_IN_SECONDS)
+                          data: bytes,
+                          tier: str = 'warm'):
+        """Запись готового тела ответа в кэш на время, зависящее от популярности."""
+        ttl = popularity.ttl(tier)
+        CACHE_WRITES.labels(self.name, tier if ttl else 'skip').inc()
+        if not ttl:
+            return
+        with tracer.start_as_current_span('cache set', attributes={
+                'service': self.name, 'cache.tier': tier}):
+            await self._redis_set(str(url), data, ttl)
+
+    @cache_call()
+    async def _redis_get(self, key: str) -> Optional[bytes]:
+        with REDIS_SECONDS.labels('get').time():
+            return await self.redis.get(key)
+
+    @cache_call()
+    async def _redis_set(self, key: str, data: bytes, expire: int) -> None:
+        with REDIS_SECONDS.labels('set').time():
+            await self.redis.set(key=key, value=data, expire=expire)
+
+    @cache_call()
+    async def _redis_ttl(self, key: str) -> Optional[int]:
+        with REDIS_SECONDS.labels('ttl').time():
+            return await self.redis.ttl(key)
+
+    @cache_call(default=False)
+    async def _redis_lock(self, key: str, expire: float) -> bool:
+        with REDIS_SECONDS.labels('set').time():
+            return await self.redis.set(key, b'1', pexpire=int(expire * 1000),
+                                        exist=self.redis.SET_IF_NOT_EXIST)
+
+    def _count_cache(self, result: str) -> None:
+        """Учесть обращение к кэшу: hit, miss, negative или snapshot"""
+        CACHE_REQUESTS.labels(self.name, result).inc()
+
+    async def get_compressed(self, etag: str, body: bytes, encoding: str) -> bytes:
+        """
+        Сжатый вариант тела ответа. Ключ строится по ETag содержимого,
+        поэтому сжатая копия не может разойтись с телом после обновления кэша.
+        """
+        key = f'{encoding}:{etag}'
+        hits = popularity.touch(key)
+        with tracer.start_as_current_span('cache compressed', attributes={
+                'service': self.name, 'encoding': encoding}) as span:
+            data = await self._redis_get(key)
+            span.set_attribute('cache.hit', data is not None)
+            if data is None:
+                data = compress(body, encoding)
+                # сжатая копия не устаревает, обновлять её не нужно
+                ttl = popularity.ttl(popularity.tier(hits))
+                if ttl:
+                    await self._redis_set(key, data, ttl)
+        return data
+
+    @staticmethod
+    def _serialize(model: Type[BaseModel], data: Any) -> bytes:
+        """
+        Проверить данные из elastic моделью ответа и сериализовать их.
+        Выполняется один раз при заполнении кэша, при попадании в кэш
+        тело ответа отдаётся как есть.
+        """
+        with SERIALIZE_SECONDS.labels(model.__name__).time():
+            if isinstance(data, list):
+                return orjson.dumps([model(**item).dict() for item in data])
+            return orjson.dumps(model(**data).dict())
@@ -1,19 +1,28 @@
 import logging
 from functools import lru_cache
-from typing import Dict, List, Optional
+from typing import List, Optional
 
-import backoff
 from aioredis import Redis
 from db.elastic import get_elastic
 from db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
-from models.film import Film
+from models.film import Film, FilmShort
 
-from services.base import BaseService
+from core.metrics import LEADERBOARD_REQUESTS, REDIS_SECONDS
+from core.resilience import cache_call, elastic_call
+from services.base import BaseService, tracer
+
+# рейтинги фильмов в redis, их ведёт ETL (FilmLeaderboard в etl/__init__.py)
+LEADERBOARD_PREFIX = '{films}'
+# формат рейтингов, должен совпадать с FilmLeaderboard.version в ETL
+LEADERBOARD_VERSION = 'v2'
 
 
 class FilmService(BaseService):
+    name = 'film'
+    index = 'movies'
+
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
@@ -21,17 +30,10 @@ class FilmService(BaseService):
     async def get_by_id(self,
                         url: str,
                         film_id: str
-                        ) -> Optional[Dict]:
+                        ) -> Optional[bytes]:
         """Функция получения фильма по id"""
-        film = await self._check_cache(url)
-        if not film:
-            film = await self._get_data_from_elastic(data_id=film_id)
-            if not film:
-                return None
-
-            await self._load_cache(url, film)
-
-        return film
+        return await self._get_detail(
+            url, film_id, Film, lambda: self._get_data_from_elastic(data_id=film_id))
 
     async def get_by_list_id(self,
                              url: str,
@@ -41,20 +43,13 @@ class FilmService(BaseService):
                              size: int,
                              *args,
                              **kwargs
-                             ) -> Optional[List[Dict]]:
+                             ) -> Optional[bytes]:
         """Функция получения фильмов по id"""
+        return await self._get_cached(
+            url, FilmShort,
+            lambda: self._get_data_with_list_film(film_ids=film_ids, page=page, size=size))
 
-        data = await self._check_cache(url)
-        if not data:
-            data = await self._get_data_with_list_film(film_ids=film_ids, page=page, size=size)
-            if not data:
-                return None
-
-            await self._load_cache(url, data)
-
-        return data
-
-    @backoff.on_exception(backoff.expo, Exception)
+    @elastic_call
     async def _get_data_with_list_film(self, film_ids: List[str], page: int, size: int):
         query = {
             "size": size,
@@ -87,7 +82,7 @@ class FilmService(BaseService):
             return None
         return [film['_source'] for film in result]
 
-    @backoff.on_exception(backoff.expo, Exception)
+    @elastic_call
     async def _get_data_from_elastic(self,
                                      data_id: Optional[str] = None,
                                      *args,
@@ -152,7 +147,6 @@ class FilmService(BaseService):
                 query['query'] = _query
 
             try:
-                logging.info(query)
                 doc = await self.elastic.search(index='movies', body=query)
             except exceptions.NotFoundError:
                 logging.error('index not found')
@@ -183,19 +177,75 @@ class FilmService(BaseService):
                            size: int,
                            genre: str = None,
                            query: str = None
-                           ) -> Optional[List[Film]]:
+                           ) -> Optional[bytes]:
         """Функция получения всех фильмов с параметрами сортфировки и фильтрации"""
-        films = await self._check_cache(url)
-        if not films:
-
-            films = await self._get_data_from_elastic(
-                **{'genre': genre, 'page': page, 'size': size, 'order': order, 'query': query})
-            if not films:
+        return await self._get_cached(
+            url, Film,
+            lambda: self._get_films_by_param(genre=genre, page=page, size=size,
+                                             order=order, query=query))
+
+    async def _get_films_by_param(self,
+                                  genre: Optional[str],
+                                  page: int,
+                                  size: int,
+                                  order: Optional[str],
+                                  query: Optional[str]
+                                  ) -> Optional[List[dict]]:
+        """
+        Списки по рейтингу без текстового поиска берём из рейтингов в redis,
+        пока они не построены или redis недоступен - из elastic
+        """
+        if order and not query:
+            film_ids = await self._get_ids_from_leaderboard(genre, page, size, order)
+            if film_ids is not None:
+                LEADERBOARD_REQUESTS.labels('served').inc()
+                return await self._get_films_by_ids(film_ids) if film_ids else []
+            LEADERBOARD_REQUESTS.labels('fallback').inc()
+        return await self._get_data_from_elastic(
+            **{'genre': genre, 'page': page, 'size': size, 'order': order, 'query': query})
+
+    @cache_call()
+    async def _get_ids_from_leaderboard(self,
+                                        genre: Optional[str],
+                                        page: int,
+                                        size: int,
+                                        order: str
+                                        ) -> Optional[List[str]]:
+        """
+        Id страницы фильмов из sorted set по рейтингу, None - рейтинги не построены.
+        Фильмы без рейтинга лежат со score -inf и, как в elastic,
+        идут последними и при обратном порядке.
+        """
+        with tracer.start_as_current_span('leaderboard', attributes={'genre': bool(genre)}), \
+                REDIS_SECONDS.labels('leaderboard').time():
+            generation = await self.redis.get(f'{LEADERBOARD_PREFIX}:current')
+            if not generation or not generation.decode().startswith(f'{LEADERBOARD_VERSION}-'):
+                # рейтинги старого формата, пока ETL их не перестроит, читаем из elastic
                 return None
-
-            await self._load_cache(url, films)
-
-        return films
+            prefix = f'{LEADERBOARD_PREFIX}:{generation.decode()}'
+            key = f'{prefix}:genre:{genre}' if genre else f'{prefix}:rating'
+            start = (page - 1) * size
+            if order != 'ASC':
+                film_ids = await self.redis.zrevrange(key, start, start + size - 1)
+            else:
+                no_rating = self.redis.ZSET_EXCLUDE_MIN
+                rated = await self.redis.zcount(key, float('-inf'), float('inf'), exclude=no_rating)
+                film_ids = []
+                if start < rated:
+                    film_ids = await self.redis.zrangebyscore(
+                        key, float('-inf'), float('inf'), exclude=no_rating,
+                        offset=start, count=size)
+                if len(film_ids) < size:
+                    film_ids += await self.redis.zrangebyscore(
+                        key, float('-inf'), float('-inf'),
+                        offset=max(start - rated, 0), count=size - len(film_ids))
+            return [film_id.decode() for film_id in film_ids]
+
+    @elastic_call
+    async def _get_films_by_ids(self, film_ids: List[str]) -> List[dict]:
+        """Документы фильмов по id в том же порядке, удалённые пропускаются"""
+        result = await self.elastic.mget(index='movies', body={'ids': film_ids})
+        return [doc['_source'] for doc in result['docs'] if doc.get('found')]
 
 
 @lru_cache()
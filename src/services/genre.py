@@ -2,18 +2,21 @@ import logging
 from functools import lru_cache
 from typing import Dict, List, Optional
 
-import backoff
 from aioredis import Redis
 from db.elastic import get_elastic
 from db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
-from models.genre import Genre
+from models.genre import GenreShort
 
+from core.resilience import elastic_call
 from services.base import BaseService
 
 
 class GenreService(BaseService):
+    name = 'genre'
+    index = 'genre'
+
     def __init__(self,
                  redis: Redis,
                  elastic: AsyncElasticsearch):
@@ -25,41 +28,26 @@ class GenreService(BaseService):
                         data_id: str,
                         *args,
                         **kwargs
-                        ) -> Optional[Genre]:
+                        ) -> Optional[bytes]:
         """Получить объект по uuid"""
-        data = await self._check_cache(url)
-        print(data)
-        print(url)
-        if not data:
-            data = await self._get_data_from_elastic(data_id)
-            if not data:
-                return None
-
-            await self._load_cache(url, data)
-
-        return data
+        return await self._get_detail(
+            url, data_id, GenreShort, lambda: self._get_data_from_elastic(data_id))
 
     async def get_all(self,
                       url: str,
                       *args,
                       **kwargs
-                      ) -> Optional[List[Genre]]:
+                      ) -> Optional[bytes]:
         """Получить все объекты"""
 
         filter = kwargs.get('filter')
         size = kwargs.get('size')
         page = kwargs.get('page')
-        data = await self._check_cache(url)
-        if not data:
-            data = await self._get_data_from_elastic(**{'filter': filter, 'size': size, 'page': page})
-            if not data:
-                return None
-
-            await self._load_cache(url, data)
-
-        return data
+        return await self._get_cached(
+            url, GenreShort,
+            lambda: self._get_data_from_elastic(**{'filter': filter, 'size': size, 'page': page}))
 
-    @backoff.on_exception(backoff.expo, Exception)
+    @elastic_call
     async def _get_data_from_elastic(self,
                                      data_id=None,
                                      *args,
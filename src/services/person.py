@@ -2,7 +2,6 @@ import logging
 from functools import lru_cache
 from typing import List, Optional
 
-import backoff
 from aioredis import Redis
 from db.elastic import get_elastic
 from db.redis import get_redis
@@ -10,10 +9,14 @@ from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
 from models.person import Person
 
+from core.resilience import elastic_call
 from services.base import BaseService
 
 
 class PersonService(BaseService):
+    name = 'person'
+    index = 'persons'
+
     def __init__(self,
                  redis: Redis,
                  elastic: AsyncElasticsearch):
@@ -25,17 +28,10 @@ class PersonService(BaseService):
                         data_id: str,
                         *args,
                         **kwargs
-                        ) -> Optional[Person]:
+                        ) -> Optional[bytes]:
         """Получить объект по uuid"""
-        data = await self._check_cache(url)
-        if not data:
-            data = await self._get_data_from_elastic(data_id)
-            if not data:
-                return None
-
-            await self._load_cache(url, data)
-
-        return data
+        return await self._get_detail(
+            url, data_id, Person, lambda: self._get_data_from_elastic(data_id))
 
     async def get_by_param(self,
                            url: str,
@@ -43,20 +39,14 @@ class PersonService(BaseService):
                            size: int,
                            *args,
                            **kwargs
-                           ) -> Optional[List[Person]]:
+                           ) -> Optional[bytes]:
         """Найти объект(ы) по ключевому слову"""
 
         q = kwargs.get('q')
-        data = await self._check_cache(url)
-        if not data:
-            data = await self._get_data_from_elastic(page=page, size=size, q=q)
-            if not data:
-                return None
-            await self._load_cache(url, data)
-
-        return data
+        return await self._get_cached(
+            url, Person, lambda: self._get_data_from_elastic(page=page, size=size, q=q))
 
-    @backoff.on_exception(backoff.expo, Exception)
+    @elastic_call
     async def _get_data_from_elastic(self,
                                      data_id=None,
                                      *args,
@@ -0,0 +1,157 @@
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Type
+
+from aioredis import Redis
+from db.snapshot import CHANGES_KEY, HOT_KEY, SnapshotStore
+from elasticsearch import AsyncElasticsearch
+from models.film import Film
+from models.genre import GenreShort
+from models.person import Person
+from opentelemetry import context as otel_context
+from pydantic import BaseModel
+
+from core import config
+from core.metrics import REDIS_SECONDS, SNAPSHOT_DOCS, SNAPSHOT_WRITES
+from core.resilience import cache_call, elastic_call, request_deadline
+from services.base import BaseService, tracer
+
+logger = logging.getLogger(__name__)
+
+# индексы в снимке и модели ответа API по id для них
+SNAPSHOT_MODELS: Dict[str, Type[BaseModel]] = {
+    'movies': Film,
+    'persons': Person,
+    'genre': GenreShort,
+}
+MGET_CHUNK = 500
+
+
+class SnapshotRefresher:
+    """
+    Поддерживает снимок горячих объектов в актуальном состоянии.
+    Запущен в каждом воркере, но пишет только тот, кто держит flock
+    на файле в каталоге снимка, остальные ждут своей очереди:
+    если писатель умер, блокировку возьмёт другой воркер.
+    Раз в SNAPSHOT_SYNC_INTERVAL секунд применяются изменения из ETL,
+    раз в SNAPSHOT_REBUILD_INTERVAL снимок собирается заново по списку
+    горячих id. Пока elastic недоступен, снимок не меняется.
+    """
+
+    def __init__(self, store: SnapshotStore, redis: Redis, elastic: AsyncElasticsearch):
+        self.store = store
+        self.redis = redis
+        self.elastic = elastic
+        self.lock_fd: Optional[int] = None
+        self.rebuilt_at = 0.0
+        self.synced_at: Dict[str, float] = {}
+
+    def _try_lead(self) -> bool:
+        if self.lock_fd is not None:
+            return True
+        fd = os.open(os.path.join(self.store.path, 'writer.lock'), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        logger.info(f'Worker {os.getpid()} writes snapshot {self.store.path}')
+        return True
+
+    async def run(self) -> None:
+        # у фоновой задачи свой корневой спан на каждый цикл, а не спан startup
+        otel_context.attach(otel_context.Context())
+        while True:
+            try:
+                if self._try_lead():
+                    if time.monotonic() - self.rebuilt_at >= config.SNAPSHOT_REBUILD_INTERVAL:
+                        await self.rebuild()
+                    else:
+                        await self.sync()
+                for index in SNAPSHOT_MODELS:
+                    SNAPSHOT_DOCS.labels(index).set(self.store.count(index))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Snapshot refresh failed: {e!r}')
+            await asyncio.sleep(config.SNAPSHOT_SYNC_INTERVAL)
+
+    @staticmethod
+    def _set_deadline() -> None:
+        # каждое обращение к бэкендам ограничено, как отдельный запрос к API
+        request_deadline.set(time.monotonic() + config.REQUEST_TIMEOUT)
+
+    async def rebuild(self) -> None:
+        """Собрать снимок заново из текущих горячих id"""
+        with tracer.start_as_current_span('snapshot rebuild'):
+            for index, model in SNAPSHOT_MODELS.items():
+                self._set_deadline()
+                started = time.time()
+                ids = await self._hot_ids(index, started - config.SNAPSHOT_HOT_WINDOW)
+                if not ids:
+                    # redis недоступен или пуст - оставляем прежний снимок
+                    continue
+                bodies = await self._fetch(index, model, ids)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.store.replace, index, bodies)
+                SNAPSHOT_WRITES.labels(index, 'rebuild').inc(len(bodies))
+                # изменения, сделанные во время сборки, догонит sync
+                self.synced_at[index] = started
+        self.rebuilt_at = time.monotonic()
+
+    async def sync(self) -> None:
+        """Перечитать документы снимка, которые ETL изменил с прошлой синхронизации"""
+        for index, model in SNAPSHOT_MODELS.items():
+            self._set_deadline()
+            started = time.time()
+            # запас на расхождение часов узлов ETL и API, лишнее перечитывание безвредно
+            since = self.synced_at.get(index, started) - config.SNAPSHOT_SYNC_INTERVAL
+            changed = await self._changed_ids(index, since)
+            if changed is None:
+                continue
+            ids = [doc_id for doc_id in changed if self.store.contains(index, doc_id)]
+            if ids:
+                with tracer.start_as_current_span('snapshot sync', attributes={
+                        'elastic.index': index, 'snapshot.docs': len(ids)}):
+                    bodies = await self._fetch(index, model, ids)
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.store.update, index, bodies)
+                SNAPSHOT_WRITES.labels(index, 'sync').inc(len(bodies))
+            self.synced_at[index] = started
+
+    async def _fetch(self, index: str, model: Type[BaseModel], ids: List[str]) -> Dict[str, bytes]:
+        """Тела ответов по id, как их отдаёт сервис; удалённые из индекса пропускаются"""
+        bodies = {}
+        for start in range(0, len(ids), MGET_CHUNK):
+            self._set_deadline()
+            docs = await self._mget(index, ids[start:start + MGET_CHUNK])
+            for doc in docs:
+                if doc.get('found'):
+                    bodies[doc['_id']] = BaseService._serialize(model, doc['_source'])
+        return bodies
+
+    @elastic_call
+    async def _mget(self, index: str, ids: List[str]) -> List[dict]:
+        result = await self.elastic.mget(index=index, body={'ids': ids})
+        return result['docs']
+
+    @cache_call()
+    async def _hot_ids(self, index: str, since: float) -> Optional[List[str]]:
+        key = HOT_KEY.format(index=index)
+        with REDIS_SECONDS.labels('zrevrangebyscore').time():
+            # старые id больше не нужны, список не растёт бесконечно
+            await self.redis.zremrangebyscore(key, float('-inf'), since)
+            ids = await self.redis.zrevrangebyscore(
+                key, float('inf'), since, offset=0, count=config.SNAPSHOT_SIZE)
+        return [doc_id.decode() for doc_id in ids]
+
+    @cache_call()
+    async def _changed_ids(self, index: str, since: float) -> Optional[List[str]]:
+        with REDIS_SECONDS.labels('zrangebyscore').time():
+            ids = await self.redis.zrangebyscore(
+                CHANGES_KEY.format(index=index), since, float('inf'))
+        return [doc_id.decode() for doc_id in ids]